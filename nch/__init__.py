@@ -1,8 +1,23 @@
 import os
 
-import appdirs
-
 
 APPNAME = 'NewGRF Cargo Helper'
 APPAUTHOR = 'NewGRF'
-CONFIG_PATH = os.path.join(appdirs.user_data_dir(APPNAME, APPAUTHOR), 'config')
+
+
+def __getattr__(name):
+    # Paths are resolved on first use, so importing nch stays cheap
+    if name == 'DATA_DIR':
+        import appdirs
+        value = appdirs.user_data_dir(APPNAME, APPAUTHOR)
+    elif name == 'CONFIG_PATH':
+        value = os.path.join(__getattr__('DATA_DIR'), 'config')
+    elif name == 'LABEL_DB_PATH':
+        value = os.path.join(__getattr__('DATA_DIR'), 'labels.db')
+    elif name == 'CACHE_DIR':
+        value = os.path.join(__getattr__('DATA_DIR'), 'cache')
+    else:
+        raise AttributeError(
+            "module 'nch' has no attribute '{}'".format(name))
+    globals()[name] = value
+    return value
@@ -0,0 +1,33 @@
+"""Python ints as bitsets of label positions, bit n set for label n"""
+
+
+def from_positions(positions, size):
+    """Bitset with the bits at the positions set"""
+    data = bytearray((size + 7) // 8)
+    for i in positions:
+        data[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(data, 'little')
+
+
+def iter_positions(bits):
+    """Iterate over the positions set in a bitset, in order"""
+    digits = bin(bits)[:1:-1]
+    i = digits.find('1')
+    while i != -1:
+        yield i
+        i = digits.find('1', i + 1)
+
+
+def count(bits):
+    return bin(bits).count('1')
+
+
+def subsets(mask):
+    """All subsets of the bits in mask, largest first, ending with 0"""
+    out = []
+    s = mask
+    while True:
+        out.append(s)
+        if not s:
+            return out
+        s = (s - 1) & mask
@@ -1,52 +1,449 @@
+from array import array
+import copy
+import operator
+
+import nch.bits
+import nch.export
+import nch.fetch
 import nch.labels
 import nch.classes
+import nch.rules
+import nch.search
+import nch.timing
+
+# Earlier versions always used the FIRS classes from the wiki notes
+DEFAULT_PROFILE = 'FIRS'
+
+
+class ProfileIndex:
+    """Class masks of the labels in one profile, and their query index"""
+    __slots__ = ('masks', 'class_bits', 'query_cache')
+
+    def __init__(self, masks, class_bits):
+        self.masks = masks
+        self.class_bits = class_bits
+        self.query_cache = {}
 
 
 class Cargos:
-    def __init__(self, ignore_unknown_labels=True):
+    # Selection results are memoized per (selection, mode), keep it bounded
+    query_cache_size = 1024
+
+    def __init__(self, ignore_unknown_labels=True, profile=DEFAULT_PROFILE,
+                 custom_masks=None, classes=None):
         self.labels = []
-        self.classes = nch.classes.all
+        # Classes of these labels, the built-in ones until fetched
+        self.classes = list(classes or nch.classes.builtin)
         self.ignore_unknown_labels = ignore_unknown_labels
+        self.profile = profile
+        # Label code to class mask overrides of the custom profile
+        self.custom_masks = dict(custom_masks or {})
+        self.build_index()
 
-    def refresh(self):
-        self.labels = []
-        for lb in nch.labels.fetch_labels():
+    @nch.timing.timed('cargos.refresh')
+    def refresh(self, cancelled=None, previous=None):
+        """Fetch labels and classes from the wiki.
+
+        Returns the nch.labels.LabelDiff from previous labels, the
+        current ones by default. Unchanged labels keep their objects.
+        Raises nch.labels.Cancelled if cancelled returns true before the
+        labels are replaced. The fetched classes replace self.classes."""
+        fetched, classes = nch.fetch.fetch_all(cancelled=cancelled)
+        labels = []
+        for lb in fetched:
             if self.ignore_unknown_labels and not lb.industries:
                 continue
-            self.labels.append(lb)
-        self.classes = nch.classes.all
-        # Map classes to labels, and vice versa
-        for lb in self.labels:
-            for cl in self.classes:
-                if lb.bitmask & cl.value:
-                    lb.classes.add(cl)
-                    cl.labels.add(lb)
+            labels.append(lb)
+        if cancelled and cancelled():
+            raise nch.labels.Cancelled()
+        if previous is None:
+            previous = self.labels
+        diff = nch.labels.diff_labels(previous, labels)
+        self.set_labels(diff.labels, classes=classes)
+        return diff
+
+    def set_labels(self, labels, masks=None, classes=None):
+        """Replace the labels, and rebuild the indexes.
+
+        masks maps each profile to the class masks of the labels, they
+        are taken from the labels when not given. classes default to the
+        current classes.
+
+        The new state is built aside and swapped in with one assignment,
+        so other threads see either the old or the new labels, and
+        nothing of the old state stays reachable from here."""
+        fresh = Cargos.__new__(Cargos)
+        fresh.ignore_unknown_labels = self.ignore_unknown_labels
+        fresh.profile = self.profile
+        fresh.custom_masks = self.custom_masks
+        fresh.labels = labels
+        fresh.classes = list(classes if classes is not None
+                             else self.classes)
+        fresh.build_index(masks)
+        self.__dict__ = fresh.__dict__
+
+    def class_labels(self, cl):
+        """Labels of a class in the active profile.
+
+        Class relations are kept in the class index of each Cargos, class
+        objects do not refer to labels."""
+        return self.labels_of(self.class_bits[cl.value])
+
+    def profile_masks(self, profile):
+        """Class masks of the labels in profile, as an array"""
+        masks = array('H', (lb.bitmask & 0xFFFF for lb in self.labels))
+        if profile == 'custom':
+            for code, mask in self.custom_masks.items():
+                for i in self.code_positions.get(code, ()):
+                    masks[i] = mask
+        elif profile != 'default':
+            for i, lb in enumerate(self.labels):
+                if lb.variants:
+                    masks[i] = lb.profile_mask(profile) & 0xFFFF
+        return masks
+
+    def class_index(self, masks):
+        """Bitset of the labels in each class"""
+        return {cl.value: nch.bits.from_positions(
+                    (i for i, m in enumerate(masks) if m & cl.value),
+                    len(masks))
+                for cl in self.classes}
+
+    def derive_index(self, base, masks):
+        """Profile index of masks, patched from the base profile index.
+
+        Profiles differ from the wiki table for few labels, so only their
+        bits are flipped. Equal profiles share the base index."""
+        diff = [i for i, (a, b) in enumerate(zip(base.masks, masks))
+                if a != b]
+        if not diff:
+            return base
+        class_bits = dict(base.class_bits)
+        for value in class_bits:
+            flip = nch.bits.from_positions(
+                (i for i in diff if (base.masks[i] ^ masks[i]) & value),
+                len(masks))
+            class_bits[value] ^= flip
+        return ProfileIndex(masks, class_bits)
+
+    @nch.timing.timed('cargos.build_index')
+    def build_index(self, masks=None):
+        """Pack the label class masks, and index label positions by class,
+        for every profile.
+
+        Label sets are python ints used as bitsets, bit n is set when
+        self.labels[n] is in the set."""
+        self.label_positions = {lb: i for i, lb in enumerate(self.labels)}
+        self.code_positions = {}
+        for i, lb in enumerate(self.labels):
+            self.code_positions.setdefault(lb.label, []).append(i)
+        self.all_labels_bits = (1 << len(self.labels)) - 1
+        self.all_classes_mask = 0
+        for cl in self.classes:
+            self.all_classes_mask |= cl.value
+        if masks is None:
+            masks = {}
+        base_masks = masks.get('default') or self.profile_masks('default')
+        base = ProfileIndex(base_masks, self.class_index(base_masks))
+        self.profiles = {'default': base}
+        for name in nch.labels.PROFILES[1:]:
+            self.set_profile_index(
+                name, masks.get(name) or self.profile_masks(name))
+        if masks.get('custom'):
+            self.custom_masks = self.overrides(masks['custom'])
+        self.search_index = None
+        self.set_profile(self.profile)
+
+    def set_profile_index(self, profile, masks):
+        self.profiles[profile] = self.derive_index(
+            self.profiles['default'], masks)
+
+    def overrides(self, masks):
+        """Label codes and masks where masks differ from the wiki table"""
+        base = self.profiles['default'].masks
+        return {self.labels[i].label: m
+                for i, m in enumerate(masks) if m != base[i]}
+
+    def set_profile(self, profile):
+        """Switch the class masks used by all queries to profile.
+
+        The indexes of all profiles are built with the labels, so this
+        only swaps them in."""
+        try:
+            index = self.profiles[profile]
+        except KeyError:
+            raise ValueError('Unknown profile {}'.format(profile))
+        self.profile = profile
+        self.masks = index.masks
+        self.class_bits = index.class_bits
+        self.query_cache = index.query_cache
+
+    def view(self, profile):
+        """Cargos sharing the labels and indexes, with profile active.
+
+        Queries of the view do not change the profile of self, so
+        concurrent queries can each use their own profile."""
+        view = copy.copy(self)
+        view.set_profile(profile)
+        return view
+
+    def set_custom_masks(self, custom_masks):
+        """Replace the overrides of the custom profile"""
+        self.custom_masks = dict(custom_masks)
+        self.set_profile_index('custom', self.profile_masks('custom'))
+        if self.profile == 'custom':
+            self.set_profile('custom')
+
+    def label_bits(self, labels):
+        """Bitset of label positions"""
+        bits = 0
+        for lb in labels:
+            bits |= 1 << self.label_positions[lb]
+        return bits
+
+    def class_mask(self, classes):
+        mask = 0
+        for cl in classes:
+            mask |= cl.value
+        return mask
+
+    @nch.timing.timed('cargos.build_search_index')
+    def build_search_index(self):
+        """Build the search index of the labels, if not built yet.
+
+        Slow for many labels, the GUI builds it in a worker thread
+        before the labels are shown. The index is assigned once built,
+        so searches see either no index or a complete one."""
+        index = self.search_index
+        if index is None:
+            index = self.search_index = nch.search.LabelIndex(self.labels)
+        return index
+
+    def search(self, query):
+        """Labels matching a search query, as a bitset.
+
+        The search index is built on first use if it was not built with
+        the labels, see build_search_index."""
+        return self.build_search_index().search(query)
+
+    def class_mask_of_names(self, names_nml):
+        mask = 0
+        for cl in self.classes:
+            if cl.name_nml in names_nml:
+                mask |= cl.value
+        return mask
+
+    def iter_positions(self, bits):
+        """Iterate over the label positions set in a bitset"""
+        return nch.bits.iter_positions(bits)
+
+    def labels_of(self, bits):
+        return [self.labels[i] for i in self.iter_positions(bits)]
+
+    def classes_of(self, mask):
+        return [cl for cl in self.classes if mask & cl.value]
+
+    def _cached(self, key, func):
+        try:
+            return self.query_cache[key]
+        except KeyError:
+            pass
+        if len(self.query_cache) >= self.query_cache_size:
+            self.query_cache.clear()
+        result = self.query_cache[key] = func()
+        return result
+
+    def match_labels(self, class_mask, mode):
+        """Labels matching ANY, ALL or NONE of the classes in class_mask.
+
+        Returns a bitset of label positions."""
+        def query():
+            selected = [bits for value, bits in self.class_bits.items()
+                        if value & class_mask]
+            if mode == 'ANY' or mode == 'NONE':
+                bits = 0
+                for b in selected:
+                    bits |= b
+                if mode == 'NONE':
+                    bits = ~bits & self.all_labels_bits
+                return bits
+            if mode == 'ALL':
+                if not selected:
+                    return 0
+                bits = self.all_labels_bits
+                for b in selected:
+                    bits &= b
+                return bits
+            raise ValueError('Unknown selection mode {}'.format(mode))
+        return self._cached(('labels', class_mask, mode), query)
+
+    def match_classes(self, label_bits, mode):
+        """Classes matching ANY, ALL or NONE of the labels in label_bits.
+
+        Returns a class mask."""
+        def query():
+            mask = 0
+            if mode == 'ANY' or mode == 'NONE':
+                for value, bits in self.class_bits.items():
+                    if bits & label_bits:
+                        mask |= value
+                if mode == 'NONE':
+                    mask = ~mask & self.all_classes_mask
+                return mask
+            if mode == 'ALL':
+                if not label_bits:
+                    return 0
+                for value, bits in self.class_bits.items():
+                    if bits & label_bits == label_bits:
+                        mask |= value
+                return mask
+            raise ValueError('Unknown selection mode {}'.format(mode))
+        return self._cached(('classes', label_bits, mode), query)
+
+    def code_bits(self, codes):
+        """Bitset of the labels with the given label codes"""
+        bits = 0
+        for code in codes:
+            for i in self.code_positions.get(code, ()):
+                bits |= 1 << i
+        return bits
+
+    def effective_refit(self, cargo_allow_refit=(), cargo_disallow_refit=(),
+                        refittable_mask=0, non_refittable_mask=0):
+        """Labels a vehicle refits to, as a bitset of label positions.
+
+        Same as OpenTTD: labels with any of the refittable classes and
+        none of the non refittable classes, plus the allowed labels, minus
+        the disallowed labels. Labels are given as label codes."""
+        bits = self.match_labels(refittable_mask, 'ANY') \
+            & ~self.match_labels(non_refittable_mask, 'ANY')
+        bits |= self.code_bits(cargo_allow_refit)
+        bits &= ~self.code_bits(cargo_disallow_refit)
+        return bits & self.all_labels_bits
+
+    def effective_refits(self, vehicles):
+        """effective_refit for many (cargo_allow_refit, cargo_disallow_refit,
+        refittable_mask, non_refittable_mask) tuples"""
+        return [self.effective_refit(*v) for v in vehicles]
+
+    @nch.timing.timed('cargos.solve_refit')
+    def solve_refit(self, codes):
+        """Shortest refit properties that refit to exactly the labels with
+        the given codes, as an nch.export.RefitSpec.
+
+        Picks the class mask pair passing the class rules that leaves the
+        fewest labels to allow or disallow one by one, then the one with
+        the fewest classes. Raises ValueError for unknown label codes.
+
+        Masks are searched over class subsets: with w(m) = +1 for each
+        label of class mask m outside the wanted labels and -1 for each
+        inside, and g(S) the sum of w over masks in S, included classes I
+        and excluded classes E need |wanted| + g(~E) - g(~(I | E)) labels
+        in the lists. g and its subset maximum, a bound for each E, are
+        computed once for all subsets."""
+        for code in codes:
+            if code not in self.code_positions:
+                raise ValueError('Unknown cargo label {}'.format(code))
+        target = self.code_bits(codes)
+        wanted = set(self.iter_positions(target))
+        classes = self.classes
+        size = 1 << len(classes)
+        full = size - 1
+        # Class masks of labels and rules packed to bit k for classes[k]
+        values = [0] * size
+        for k, cl in enumerate(classes):
+            bit = 1 << k
+            values[bit:2 * bit] = [v | cl.value for v in values[:bit]]
+        packed = {}
+
+        def pack(mask):
+            try:
+                return packed[mask]
+            except KeyError:
+                pass
+            p = packed[mask] = sum(1 << k for k, cl in enumerate(classes)
+                                   if mask & cl.value)
+            return p
+
+        g = [0] * size
+        for i, mask in enumerate(self.masks):
+            g[pack(mask)] += -1 if i in wanted else 1
+        for k in range(len(classes)):
+            bit = 1 << k
+            for lo in range(0, size, 2 * bit):
+                hi = lo + bit
+                g[hi:hi + bit] = map(operator.add, g[hi:hi + bit],
+                                     g[lo:hi])
+        high = list(g)
+        for k in range(len(classes)):
+            bit = 1 << k
+            for lo in range(0, size, 2 * bit):
+                hi = lo + bit
+                high[hi:hi + bit] = map(max, high[hi:hi + bit],
+                                        high[lo:hi])
+
+        # Classes a rule always forbids on a side are left out, the rules
+        # only read the included classes in ruled, so each choice of those
+        # is checked once and the other included classes are free
+        never = [0, 0]
+        ruled = pack(nch.rules.RULED_MASKS[nch.rules.INCLUDED])
+        for rule in nch.rules.RULES:
+            if not rule.when_mask:
+                never[rule.side] |= pack(rule.value)
+            ruled |= pack(rule.when_mask)
+        can_incl = full & ~never[nch.rules.INCLUDED]
+        can_excl = full & ~never[nch.rules.EXCLUDED]
+        count = len(wanted)
+        best = None
+        for excl in sorted(nch.bits.subsets(can_excl),
+                           key=lambda e: g[full & ~e] - high[full & ~e]):
+            base = full & ~excl
+            if best is not None \
+                    and count + g[base] - high[base] > best[0]:
+                # Sorted by this bound, no later excl does better
+                break
+            free = can_incl & base & ~ruled
+            frees = nch.bits.subsets(free)
+            for fixed in nch.bits.subsets(can_incl & base & ruled):
+                if nch.rules.check(values[fixed], values[excl]):
+                    continue
+                rest = base & ~fixed
+                for f in frees:
+                    incl = fixed | f
+                    key = (count + g[base] - g[rest & ~f],
+                           nch.bits.count(incl) + nch.bits.count(excl),
+                           incl, excl)
+                    if best is None or key < best:
+                        best = key
+        incl, excl = values[best[2]], values[best[3]]
+        refit = self.match_labels(incl, 'ANY') \
+            & ~self.match_labels(excl, 'ANY')
+        allow = dict.fromkeys(lb.label for lb in self.labels_of(
+            target & ~refit))
+        disallow = dict.fromkeys(lb.label for lb in self.labels_of(
+            refit & ~target))
+        return nch.export.RefitSpec(
+            '', allow, disallow,
+            [cl.name_nml for cl in self.classes_of(incl)],
+            [cl.name_nml for cl in self.classes_of(excl)],
+            classes=self.classes)
+
+    def check_classes(self, incl_ccs, excl_ccs):
+        """Rule violations of the included and excluded classes, as
+           (class, message)"""
+        by_value = {cl.value: cl for cl in self.classes}
+        return [(by_value[value], message) for value, message in
+                nch.rules.check(self.class_mask(incl_ccs),
+                                self.class_mask(excl_ccs))]
 
     def check_inclusion(self, incl_cc, excl_ccs):
         """Check if cargo class is "safe" to be included according to
            https://newgrf-specs.tt-wiki.net/wiki/Action0/Cargos#CargoClasses_.2816.29"""
-        if incl_cc == nch.classes.non_pourable:
-            return 'Never include this class'
-        return None
+        return nch.rules.check_class(incl_cc.value, nch.rules.INCLUDED,
+                                     incl_cc.value, self.class_mask(excl_ccs))
 
     def check_exclusion(self, excl_cc, incl_ccs):
         """Check if cargo class is "safe" to be excluded according to
            https://newgrf-specs.tt-wiki.net/wiki/Action0/Cargos#CargoClasses_.2816.29"""
-
-        never_exclude = {nch.classes.passengers, nch.classes.mail,
-                         nch.classes.express, nch.classes.armored,
-                         nch.classes.bulk, nch.classes.piece_goods,
-                         nch.classes.liquid}
-        if excl_cc in never_exclude:
-            return 'Never exclude this class'
-        if excl_cc in {nch.classes.refrigerated, nch.classes.oversized} \
-                and nch.classes.piece_goods not in incl_ccs:
-            return 'Only exclude when Piece Goods is included'
-        if excl_cc == nch.classes.hazardous:
-            return 'Only exclude when special wagons are provided'
-        if excl_cc == nch.classes.covered and nch.classes.liquid in incl_ccs:
-            return 'Do not exclude for Liquid'
-        if excl_cc in {nch.classes.powderized, nch.classes.non_pourable} \
-                and nch.classes.bulk not in incl_ccs:
-            return 'Only exclude when Bulk is included'
-        return None
+        return nch.rules.check_class(excl_cc.value, nch.rules.EXCLUDED,
+                                     self.class_mask(incl_ccs), excl_cc.value)
@@ -1,7 +1,20 @@
-# Semi-imported from grf wiki
+# Semi-imported from grf wiki, the classes are refreshed from the wiki at
+# runtime, each Cargos keeps the classes of its labels
+
+from html.parser import HTMLParser
+import re
+
+CLASSES_URL = 'https://newgrf-specs.tt-wiki.net/wiki/Action0/Cargos'
+HEADING_RE = re.compile(r'CargoClasses', re.IGNORECASE)
+VALUE_RE = re.compile(r'(?:0x)?([0-9A-Fa-f]{1,4})$')
+# Explanations in wiki class names, left out of derived NML names
+NOTE_RE = re.compile(r'\(.*?\)')
+WORD_RE = re.compile(r'[A-Za-z0-9]+')
 
 
 class CargoClass:
+    __slots__ = ('value', 'name', 'name_nml', 'wagon_type', 'usage', 'tips')
+
     def __init__(self, value, name, name_nml, wagon_type, usage, tips):
         self.value = value
         self.name = name
@@ -9,13 +22,9 @@ class CargoClass:
         self.wagon_type = wagon_type
         self.usage = usage
         self.tips = tips
-        self.labels = set()
 
     def __contains__(self, item):
-        return item in self.labels
-
-    def __iter__(self):
-        return iter(self.labels)
+        return bool(item.bitmask & self.value)
 
     def __str__(self):
         return self.name
@@ -130,8 +139,122 @@ all = [
     refrigerated, hazardous, covered, oversized, powderized, non_pourable
 ]
 
+# Built-in definitions, used until classes are fetched. Fetched classes
+# are kept in Cargos.classes, this list is never changed
+builtin = list(all)
+# The wiki has no NML names, known classes are mapped by value
+NML_NAMES = {cl.value: cl.name_nml for cl in builtin}
+
+
+def nml_name(value, name):
+    """NML name of a class, derived from the wiki name for new classes,
+    e.g. Non Potable (Food) becomes CC_NON_POTABLE"""
+    if value in NML_NAMES:
+        return NML_NAMES[value]
+    words = WORD_RE.findall(NOTE_RE.sub('', name)) or WORD_RE.findall(name)
+    if not words:
+        return 'CC_{:04X}'.format(value)
+    return 'CC_' + '_'.join(words).upper()
+
+
+def classes_to_rows(classes):
+    return [[cl.value, cl.name, cl.name_nml, cl.wagon_type, cl.usage,
+             cl.tips] for cl in classes]
+
+
+def classes_from_rows(rows):
+    return [CargoClass(*row) for row in rows]
+
+
+class ClassTableParser(HTMLParser):
+    """Collects the rows of the first table after the CargoClasses
+    heading of the Action0/Cargos page"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows = []
+        self.heading = None
+        self.armed = False
+        self.table_depth = 0
+        self.done = False
+        self.row = None
+        self.cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if tag in ('h1', 'h2', 'h3', 'h4', 'h5', 'h6') \
+                and not self.table_depth:
+            self.heading = []
+        elif tag == 'table' and (self.armed or self.table_depth):
+            self.table_depth += 1
+        elif self.table_depth != 1:
+            return
+        elif tag == 'tr':
+            self.row = []
+        elif tag == 'td' and self.row is not None:
+            self.end_cell()
+            self.cell = []
+
+    def handle_endtag(self, tag):
+        if self.done:
+            return
+        if self.heading is not None \
+                and tag in ('h1', 'h2', 'h3', 'h4', 'h5', 'h6'):
+            self.armed = bool(HEADING_RE.search(''.join(self.heading)))
+            self.heading = None
+        elif tag == 'table' and self.table_depth:
+            self.table_depth -= 1
+            if not self.table_depth:
+                self.done = True
+        elif self.table_depth != 1:
+            return
+        elif tag == 'td':
+            self.end_cell()
+        elif tag == 'tr' and self.row is not None:
+            self.end_cell()
+            if self.row:
+                self.rows.append(self.row)
+            self.row = None
+
+    def handle_data(self, data):
+        if self.heading is not None:
+            self.heading.append(data)
+        elif self.cell is not None:
+            self.cell.append(data)
+
+    def end_cell(self):
+        if self.cell is not None:
+            self.row.append(' '.join(''.join(self.cell).split()))
+            self.cell = None
+
+
+def parse_classes(html_doc):
+    """Cargo classes from the Action0/Cargos page, in value order.
+
+    Rows are bit, value, name, wagon type, usage and tips. Classes that
+    are not built in get an NML name derived from their name."""
+    parser = ClassTableParser()
+    parser.feed(html_doc)
+    parser.close()
+    classes = {}
+    for row in parser.rows:
+        if len(row) < 6:
+            continue
+        m = VALUE_RE.match(row[1])
+        if not m:
+            continue
+        value = int(m.group(1), base=16)
+        # Classes are single bits of the class mask
+        if value & (value - 1) or not value or value in classes:
+            continue
+        classes[value] = CargoClass(value, row[2], nml_name(value, row[2]),
+                                    row[3], row[4], row[5])
+    return [classes[value] for value in sorted(classes)]
+
 
 if __name__ == '__main__':
     def obj_str(obj):
-        return '\n'.join([str(i) for i in sorted(obj.__dict__.items())])
+        return '\n'.join(
+            str((k, getattr(obj, k))) for k in sorted(obj.__slots__))
     print('\n\n'.join(obj_str(cc) for cc in all))
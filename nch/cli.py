@@ -0,0 +1,304 @@
+"""Command line entry point, starts the GUI without a command"""
+
+import argparse
+import sys
+
+
+def cmd_gui(args):
+    import nch.ui
+    nch.ui.main()
+
+
+def cmd_export(args):
+    import nch.export
+    import nch.fetch
+    with open(args.spec, encoding='utf-8') as f:
+        specs = nch.export.load_specs(f, nch.fetch.cached_classes())
+    if args.output == '-':
+        nch.export.export_specs(specs, sys.stdout, args.format, args.jobs)
+    else:
+        with open(args.output, 'w', encoding='utf-8', newline='') as out:
+            nch.export.export_specs(specs, out, args.format, args.jobs)
+
+
+def cmd_lint(args):
+    import nch.fetch
+    import nch.rules
+    known_labels = None
+    classes = nch.fetch.cached_classes()
+    if args.check_labels:
+        cargos = load_saved_cargos()
+        known_labels = {lb.label for lb in cargos.labels}
+        classes = cargos.classes
+    errors = 0
+    with open(args.sheet, encoding='utf-8', newline='') as f:
+        for error in nch.rules.lint_tsv(f, args.names, known_labels,
+                                        classes):
+            print('{}:{}'.format(args.sheet, error))
+            errors += 1
+    if errors:
+        sys.exit(1)
+
+
+def load_saved_cargos():
+    import nch.fetch
+    import nch.snapshot
+    cargos = nch.snapshot.load(nch.CONFIG_PATH,
+                               nch.fetch.cached_classes())
+    if cargos is None:
+        raise ValueError('No saved labels, refresh labels first')
+    return cargos
+
+
+def cmd_resolve(args):
+    import nch.export
+    cargos = load_saved_cargos()
+    if args.custom:
+        import nch.labels
+        with open(args.custom, encoding='utf-8') as f:
+            cargos.set_custom_masks(
+                nch.labels.load_custom_masks(f, cargos.classes))
+    if args.profile:
+        cargos.set_profile(args.profile)
+    with open(args.spec, encoding='utf-8') as f:
+        specs = nch.export.load_specs(f, cargos.classes)
+    vehicles = [(spec.cargo_allow_refit, spec.cargo_disallow_refit,
+                 cargos.class_mask_of_names(spec.refittable_cargo_classes),
+                 cargos.class_mask_of_names(
+                     spec.non_refittable_cargo_classes))
+                for spec in specs]
+    for spec, bits in zip(specs, cargos.effective_refits(vehicles)):
+        print('{}\t{}'.format(spec.name, ', '.join(
+            lb.label for lb in cargos.labels_of(bits))))
+
+
+def cmd_solve(args):
+    import nch.export
+    cargos = load_saved_cargos()
+    if args.profile:
+        cargos.set_profile(args.profile)
+    spec = cargos.solve_refit(args.labels)
+    if args.format == 'tsv':
+        nch.export.write_tsv(sys.stdout, [nch.export.spec_fields(spec)])
+    else:
+        nch.export.write_nml(sys.stdout, *spec.properties())
+
+
+def cmd_scan(args):
+    import nch.export
+    import nch.fetch
+    import nch.scan
+    project = nch.scan.scan_project(args.root, jobs=args.jobs,
+                                    use_cache=not args.no_cache)
+    try:
+        cargos = load_saved_cargos()
+    except ValueError as e:
+        known = None
+        classes = nch.fetch.cached_classes()
+        print('nch: {}, labels not checked'.format(e), file=sys.stderr)
+    else:
+        known = set(cargos.code_positions)
+        classes = cargos.classes
+    problems = []
+    if known is not None:
+        for path, line, prop, label in project.unknown_labels(known):
+            problems.append('{}:{}: unknown label {} in {}'.format(
+                path, line, label, prop))
+    for path, line, prop, name in project.unknown_classes(classes):
+        problems.append('{}:{}: unknown cargo class {} in {}'.format(
+            path, line, name, prop))
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    needed = project.needed_labels()
+    kept = set(needed)
+    unused = [lb for lb in project.cargotable() if lb not in kept]
+    if unused:
+        print('unused cargotable labels: {}'.format(', '.join(unused)),
+              file=sys.stderr)
+    print('{} files, {} scanned, {} labels needed'.format(
+        len(project.files), project.scanned, len(needed)), file=sys.stderr)
+    if args.output == '-':
+        nch.export.write_cargotable(sys.stdout, needed)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w', encoding='utf-8') as out:
+            nch.export.write_cargotable(out, needed)
+            out.write('\n')
+
+
+def cmd_refresh(args):
+    import nch.cargos
+    import nch.snapshot
+    try:
+        cargos = load_saved_cargos()
+    except ValueError:
+        cargos = nch.cargos.Cargos(ignore_unknown_labels=True)
+    diff = cargos.refresh()
+    nch.snapshot.save(cargos, nch.CONFIG_PATH)
+    if args.verbose:
+        for line in diff.lines():
+            print(line)
+    print('{} labels, {}'.format(len(cargos.labels), diff.summary()))
+
+
+def cmd_publish(args):
+    import nch.labeldb
+    cargos = load_saved_cargos()
+    if args.profile:
+        cargos.set_profile(args.profile)
+    path = args.output or nch.LABEL_DB_PATH
+    nch.labeldb.publish(cargos, path)
+    print('{} labels published to {}'.format(len(cargos.labels), path))
+
+
+def cmd_serve(args):
+    import nch.serve
+    service = nch.serve.Service(load_saved_cargos())
+    nch.serve.serve(service, args.port, args.socket)
+
+
+def cmd_query(args):
+    import json
+    import nch.serve
+    if args.batch == '-':
+        queries = json.load(sys.stdin)
+    else:
+        with open(args.batch, encoding='utf-8') as f:
+            queries = json.load(f)
+    results = nch.serve.query(queries, args.port, args.socket)
+    json.dump(results, sys.stdout, indent=1)
+    sys.stdout.write('\n')
+    if not isinstance(results, list) or \
+            not all(r.get('ok') for r in results):
+        sys.exit(1)
+
+
+def parser():
+    p = argparse.ArgumentParser(prog='nch')
+    p.add_argument(
+        '--timing', metavar='PATH',
+        help='write phase timings as json to PATH at exit, - for stderr')
+    sub = p.add_subparsers(dest='command')
+    p.set_defaults(func=cmd_gui)
+
+    export = sub.add_parser(
+        'export', help='export refit properties of many vehicles')
+    export.add_argument(
+        'spec', help='json file with the refit properties of each vehicle')
+    export.add_argument(
+        '-f', '--format', default='nml', choices=['nml', 'tsv', 'tsv-named'],
+        help='tsv-named prefixes each row with the vehicle name')
+    export.add_argument(
+        '-o', '--output', default='-', help='output file, - for stdout')
+    export.add_argument(
+        '-j', '--jobs', type=int, default=None,
+        help='format in N worker processes, serially by default')
+    export.set_defaults(func=cmd_export)
+
+    lint = sub.add_parser(
+        'lint', help='check a TSV refit sheet against the cargo class rules')
+    lint.add_argument('sheet', help='TSV in the layout of the TSV export')
+    lint.add_argument(
+        '--names', action='store_true',
+        help='first column is the vehicle name, as in tsv-named exports')
+    lint.add_argument(
+        '--check-labels', action='store_true',
+        help='report labels missing from the saved labels')
+    lint.set_defaults(func=cmd_lint)
+
+    resolve = sub.add_parser(
+        'resolve', help='list the labels each vehicle refits to')
+    resolve.add_argument(
+        'spec', help='json file with the refit properties of each vehicle')
+    resolve.add_argument(
+        '-p', '--profile',
+        choices=['default', 'FIRS', 'ECS', 'YETI', 'custom'],
+        help='class masks to resolve with, the saved profile by default')
+    resolve.add_argument(
+        '--custom', metavar='PATH',
+        help='json file of label classes for the custom profile')
+    resolve.set_defaults(func=cmd_resolve)
+
+    refresh = sub.add_parser(
+        'refresh', help='refresh the saved labels from the wiki, and list '
+                        'what changed')
+    refresh.add_argument(
+        '-v', '--verbose', action='store_true',
+        help='list every added, removed and changed label')
+    refresh.set_defaults(func=cmd_refresh)
+
+    solve = sub.add_parser(
+        'solve', help='find the shortest refit properties that refit to '
+                      'exactly the given labels')
+    solve.add_argument('labels', nargs='+', help='label codes')
+    solve.add_argument(
+        '-p', '--profile',
+        choices=['default', 'FIRS', 'ECS', 'YETI', 'custom'],
+        help='class masks to solve with, the saved profile by default')
+    solve.add_argument(
+        '-f', '--format', default='nml', choices=['nml', 'tsv'])
+    solve.set_defaults(func=cmd_solve)
+
+    scan = sub.add_parser(
+        'scan', help='find the labels an NML project uses, and write the '
+                     'cargotable it needs')
+    scan.add_argument('root', help='project directory')
+    scan.add_argument(
+        '-o', '--output', default='-',
+        help='output file for the cargotable, - for stdout')
+    scan.add_argument(
+        '-j', '--jobs', type=int, default=None,
+        help='worker processes for large projects, 1 disables them')
+    scan.add_argument(
+        '--no-cache', action='store_true',
+        help='scan all files, ignoring and not updating the cache')
+    scan.set_defaults(func=cmd_scan)
+
+    publish = sub.add_parser(
+        'publish', help='write the saved labels as a read-only database '
+                        'that build workers memory map')
+    publish.add_argument(
+        '-o', '--output', metavar='PATH',
+        help='database file, labels.db in the data directory by default')
+    publish.add_argument(
+        '-p', '--profile',
+        choices=['default', 'FIRS', 'ECS', 'YETI', 'custom'],
+        help='profile looked up by default, the saved profile by default')
+    publish.set_defaults(func=cmd_publish)
+
+    serve = sub.add_parser(
+        'serve', help='answer json queries on the saved labels, until '
+                      'interrupted')
+    query = sub.add_parser(
+        'query', help='send a json batch of queries to a running serve')
+    query.add_argument(
+        'batch', nargs='?', default='-',
+        help='json file with a list of queries, - for stdin')
+    for cmd in (serve, query):
+        cmd.add_argument(
+            '--port', type=int, default=8787,
+            help='localhost HTTP port, 8787 by default')
+        cmd.add_argument(
+            '--socket', metavar='PATH',
+            help='use a Unix socket at PATH instead of HTTP')
+    serve.set_defaults(func=cmd_serve)
+    query.set_defaults(func=cmd_query)
+    return p
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    if args.timing:
+        import nch.timing
+        nch.timing.enable(args.timing)
+    if args.command is None:
+        args.func(args)
+        return
+    try:
+        args.func(args)
+    except (OSError, ValueError) as e:
+        sys.exit('nch: {}'.format(e))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""NML, TSV and cargotable output for refit properties.
+
+The write_* functions stream to any object with a write method, like a
+file, a pipe or a clipboard adapter. The string building functions are
+kept for short outputs."""
+
+import csv
+import io
+import json
+
+import nch.classes
+import nch.timing
+
+PROPERTIES = ('cargo_allow_refit', 'cargo_disallow_refit',
+              'refittable_cargo_classes', 'non_refittable_cargo_classes')
+
+
+class RefitSpec:
+    """Refit properties of one vehicle, labels and NML class names"""
+
+    def __init__(self, name='', cargo_allow_refit=(), cargo_disallow_refit=(),
+                 refittable_cargo_classes=(),
+                 non_refittable_cargo_classes=(), classes=None):
+        self.name = name
+        self.cargo_allow_refit = list(cargo_allow_refit)
+        self.cargo_disallow_refit = list(cargo_disallow_refit)
+        self.refittable_cargo_classes = sort_classes(
+            refittable_cargo_classes, classes)
+        self.non_refittable_cargo_classes = sort_classes(
+            non_refittable_cargo_classes, classes)
+
+    def properties(self):
+        return [getattr(self, p) for p in PROPERTIES]
+
+
+def sort_classes(names, classes=None):
+    """Sort NML class names in the order of classes, the built-in ones by
+    default, and check they exist"""
+    order = {cc.name_nml: i
+             for i, cc in enumerate(classes or nch.classes.builtin)}
+    for name in names:
+        if name not in order:
+            raise ValueError('Unknown cargo class {}'.format(name))
+    return sorted(set(names), key=order.get)
+
+
+def nml_lines(cargo_allow_refit, cargo_disallow_refit,
+              refittable_cargo_classes, non_refittable_cargo_classes):
+    out = []
+    for prop, labels in [('cargo_allow_refit', cargo_allow_refit),
+                         ('cargo_disallow_refit', cargo_disallow_refit)]:
+        out.append('{}: [{}];'.format(prop, ', '.join(labels)))
+    for prop, ccs in [
+            ('refittable_cargo_classes', refittable_cargo_classes),
+            ('non_refittable_cargo_classes', non_refittable_cargo_classes)]:
+        if ccs:
+            value = 'bitmask({})'.format(', '.join(ccs))
+        else:
+            value = 'NO_CARGO_CLASS'
+        out.append('{}: {};'.format(prop, value))
+    return out
+
+
+def tsv_fields(cargo_allow_refit, cargo_disallow_refit,
+               refittable_cargo_classes, non_refittable_cargo_classes):
+    row = [', '.join(cargo_allow_refit), ', '.join(cargo_disallow_refit),
+           ', '.join(refittable_cargo_classes),
+           ', '.join(non_refittable_cargo_classes)]
+    # If last element is empty, it wont get pasted to google sheets
+    if row[-1] == '':
+        row[-1] = ' '
+    return row
+
+
+def tsv_line(fields):
+    f = io.StringIO()
+    writer = csv.writer(f, delimiter='\t')
+    writer.writerow(fields)
+    return f.getvalue()
+
+
+def cargotable(labels):
+    out = io.StringIO()
+    write_cargotable(out, labels)
+    return out.getvalue()
+
+
+def write_nml(out, *properties):
+    for line in nml_lines(*properties):
+        out.write(line)
+        out.write('\n')
+
+
+def write_tsv(out, rows):
+    """Write rows of tsv_fields, one line each"""
+    csv.writer(out, delimiter='\t').writerows(rows)
+
+
+def write_cargotable(out, labels):
+    """Write a cargotable of labels, one label at a time"""
+    out.write('cargotable {\n    ')
+    sep = ''
+    for label in labels:
+        out.write(sep)
+        out.write(label)
+        sep = ', '
+    out.write('\n}')
+
+
+def format_spec_nml(spec):
+    lines = nml_lines(*spec.properties())
+    if spec.name:
+        lines.insert(0, '// {}'.format(spec.name))
+    return '\n'.join(lines) + '\n\n'
+
+
+def format_spec_tsv(spec, names=False):
+    return tsv_line(spec_fields(spec, names))
+
+
+def format_spec_tsv_named(spec):
+    return format_spec_tsv(spec, names=True)
+
+
+FORMATTERS = {
+    'nml': format_spec_nml,
+    'tsv': format_spec_tsv,
+    'tsv-named': format_spec_tsv_named,
+}
+
+
+def load_specs(f, classes=None):
+    """Load refit specs from a json file, class names of classes.
+
+    The file holds a list of objects with a name and the four refit
+    properties, or an object mapping names to the properties."""
+    data = json.load(f)
+    if isinstance(data, dict):
+        if not all(isinstance(props, dict) for props in data.values()):
+            raise ValueError('Refit properties must be objects')
+        data = [dict(props, name=name) for name, props in data.items()]
+    if not isinstance(data, list):
+        raise ValueError('Spec file must hold a list or an object')
+    specs = []
+    for item in data:
+        if not isinstance(item, dict):
+            raise ValueError('Refit specs must be objects, not {}'.format(
+                json.dumps(item)))
+        name = item.get('name', '')
+        if not isinstance(name, str):
+            raise ValueError('Spec name must be a string, not {}'.format(
+                json.dumps(name)))
+        unknown = set(item) - set(PROPERTIES) - {'name'}
+        if unknown:
+            raise ValueError('Unknown properties in {}: {}'.format(
+                name or '?', ', '.join(sorted(unknown))))
+        for prop in PROPERTIES:
+            value = item.get(prop, [])
+            # A bare string would be split into characters
+            if not isinstance(value, list) \
+                    or not all(isinstance(v, str) for v in value):
+                raise ValueError('{} of {} must be a list of strings'.format(
+                    prop, name or '?'))
+        specs.append(RefitSpec(classes=classes, **item))
+    return specs
+
+
+def spec_fields(spec, names=False):
+    fields = tsv_fields(*spec.properties())
+    if names:
+        fields.insert(0, spec.name)
+    return fields
+
+
+def write_specs(out, specs, fmt='nml'):
+    """Write specs in order, TSV formats as one row per spec"""
+    if fmt not in FORMATTERS:
+        raise ValueError('Unknown format {}'.format(fmt))
+    if fmt == 'nml':
+        for spec in specs:
+            out.write(format_spec_nml(spec))
+    else:
+        names = fmt == 'tsv-named'
+        write_tsv(out, (spec_fields(spec, names) for spec in specs))
+
+
+def use_pool(jobs):
+    # Formatting a spec is cheaper than pickling it to a worker, so the
+    # pool is only used when asked for, see tools/bench_export.py
+    return jobs is not None and jobs > 1
+
+
+def iter_formatted(specs, fmt='nml', jobs=None):
+    """Yield formatted specs in order, in jobs worker processes if given"""
+    formatter = FORMATTERS[fmt]
+    if not use_pool(jobs):
+        for spec in specs:
+            yield formatter(spec)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    chunksize = max(1, len(specs) // (4 * jobs))
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        yield from pool.map(formatter, specs, chunksize=chunksize)
+
+
+@nch.timing.timed('export.specs')
+def export_specs(specs, out, fmt='nml', jobs=None):
+    if not use_pool(jobs):
+        write_specs(out, specs, fmt)
+        return
+    for text in iter_formatted(specs, fmt, jobs):
+        out.write(text)
@@ -0,0 +1,88 @@
+"""Fetching of the wiki pages the labels and cargo classes come from.
+
+The pages are fetched concurrently over one pooled session, so a refresh
+takes about one round trip. Parsed results are cached with the pages."""
+
+import nch.classes
+import nch.labels
+import nch.timing
+import nch.webcache
+
+PAGES = (nch.labels.LABELS_URL, nch.classes.CLASSES_URL)
+# Bump when class parsing changes, so cached parse results are not reused
+CLASSES_KIND = 'classes-v2'
+
+
+def pooled_session(pool_size=len(PAGES)):
+    """requests session keeping a connection per concurrent request"""
+    # Imported here, it is slow to import and rarely needed
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def fetch_pages(urls, cache):
+    """Get pages concurrently through cache.
+
+    Returns a dict of url to the CachedPage, or to the OSError raised
+    getting it (requests exceptions are OSErrors)."""
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=len(urls)) as pool:
+        futures = [(url, pool.submit(cache.get, url)) for url in urls]
+    pages = {}
+    for url, future in futures:
+        try:
+            pages[url] = future.result()
+        except OSError as e:
+            pages[url] = e
+    return pages
+
+
+def classes_of_page(page, cache):
+    """Classes of a fetched page, parsed once per page body"""
+    rows = cache.load_derived(page.digest, CLASSES_KIND)
+    if rows is not None:
+        return nch.classes.classes_from_rows(rows)
+    classes = nch.classes.parse_classes(page.text)
+    cache.store_derived(page.digest, CLASSES_KIND,
+                        nch.classes.classes_to_rows(classes))
+    return classes
+
+
+@nch.timing.timed('fetch.all')
+def fetch_all(cache=None, cancelled=None, urls=PAGES):
+    """Fetch and parse the labels and the cargo classes.
+
+    urls are the labels and the classes page. Returns (labels, classes).
+    Errors getting the labels are raised, the built-in classes are
+    returned if the classes page can not be had."""
+    if cache is None:
+        cache = nch.webcache.PageCache(session=pooled_session())
+    labels_url, classes_url = urls
+    with nch.timing.span('fetch.pages'):
+        pages = fetch_pages(urls, cache)
+    page = pages[labels_url]
+    if isinstance(page, Exception):
+        raise page
+    labels = nch.labels.labels_of_page(page, cache, cancelled)
+    page = pages[classes_url]
+    classes = []
+    if not isinstance(page, Exception):
+        classes = classes_of_page(page, cache)
+    return labels, classes or list(nch.classes.builtin)
+
+
+def cached_classes(cache=None):
+    """Classes parsed from the cached classes page, the built-in classes
+    if there is none"""
+    if cache is None:
+        cache = nch.webcache.PageCache()
+    meta = cache.load_meta(nch.classes.CLASSES_URL)
+    rows = meta and cache.load_derived(meta['digest'], CLASSES_KIND)
+    if rows:
+        return nch.classes.classes_from_rows(rows)
+    return list(nch.classes.builtin)
@@ -0,0 +1,253 @@
+"""Read-only label database, memory mapped and shared between processes.
+
+Published from Cargos for build workers that only look labels up. The
+file is mapped read-only and its columns are read in place, so every
+process opening it shares the page cache copy instead of building its
+own labels.
+
+Layout, all integers little endian, every section 4 byte aligned:
+    header     magic, version, flags, label count, code width, profile
+               count, active profile, hash slots, heap length
+    hash       uint32 per slot, label position + 1 or 0 when empty,
+               open addressing on crc32 of the code with linear probing
+    offsets    uint32 byte offsets into heap, 2 per label + end offset
+    masks      uint16 class bitmask per label, one column per profile in
+               the order of nch.labels.PROFILES
+    codes      label codes, ascii padded with NUL to the code width
+    heap       utf-8 description and industries of each label
+
+Industries of one label are separated by INDUSTRY_SEP. Publishing
+replaces the file, processes that have the old one open keep reading it."""
+
+from array import array
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+import nch.cargos
+import nch.labels
+from nch.snapshot import FLAG_IGNORE_UNKNOWN, INDUSTRY_SEP
+
+MAGIC = b'NCHD'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIHHHxxII')
+
+
+def _little_endian(arr):
+    if sys.byteorder != 'little':
+        arr.byteswap()
+    return arr
+
+
+def _pad(n):
+    return b'\0' * (-n % 4)
+
+
+def _slot_count(count):
+    # Under half full, so probes stay short
+    slots = 8
+    while slots < 2 * count:
+        slots *= 2
+    return slots
+
+
+def dumps(cargos):
+    profiles = nch.labels.PROFILES
+    codes = [lb.label.encode('utf-8') for lb in cargos.labels]
+    width = max([4] + [len(code) for code in codes])
+    slots = _slot_count(len(codes))
+    table = array('I', bytes(4 * slots))
+    for i, code in enumerate(codes):
+        slot = zlib.crc32(code) & (slots - 1)
+        while table[slot]:
+            slot = (slot + 1) & (slots - 1)
+        table[slot] = i + 1
+    offsets = array('I')
+    parts = []
+    pos = 0
+    for lb in cargos.labels:
+        for s in (lb.description, INDUSTRY_SEP.join(lb.industries)):
+            offsets.append(pos)
+            data = s.encode('utf-8')
+            parts.append(data)
+            pos += len(data)
+    offsets.append(pos)
+    masks = array('H')
+    for name in profiles:
+        masks.extend(cargos.profiles[name].masks)
+    flags = FLAG_IGNORE_UNKNOWN if cargos.ignore_unknown_labels else 0
+    header = HEADER.pack(MAGIC, VERSION, flags, len(codes), width,
+                         len(profiles), profiles.index(cargos.profile),
+                         slots, pos)
+    masks_bytes = _little_endian(masks).tobytes()
+    codes_bytes = b''.join(code.ljust(width, b'\0') for code in codes)
+    return b''.join([header, _little_endian(table).tobytes(),
+                     _little_endian(offsets).tobytes(),
+                     masks_bytes, _pad(len(masks_bytes)),
+                     codes_bytes, _pad(len(codes_bytes))] + parts)
+
+
+def publish(cargos, path=None):
+    """Write the label database of cargos, replacing the published one"""
+    if path is None:
+        path = nch.LABEL_DB_PATH
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(dumps(cargos))
+    os.replace(tmp, path)
+
+
+class LabelDB:
+    """Published labels, looked up in place in a read-only memory map.
+
+    Label positions are the positions in the published Cargos. Raises
+    ValueError if the file is not a label database of a known version."""
+
+    def __init__(self, path=None):
+        if path is None:
+            path = nch.LABEL_DB_PATH
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._map()
+        except (ValueError, TypeError, struct.error):
+            self.close()
+            raise ValueError('{} is not a label database'.format(path))
+
+    def _map(self):
+        mm = self._mm
+        magic, version, flags, count, width, columns, active, slots, \
+            heap_len = HEADER.unpack_from(mm, 0)
+        profiles = nch.labels.PROFILES
+        if magic != MAGIC or version != VERSION \
+                or columns != len(profiles) or active >= columns:
+            raise ValueError()
+        self.ignore_unknown_labels = bool(flags & FLAG_IGNORE_UNKNOWN)
+        self.profile = profiles[active]
+        self._count = count
+        self._width = width
+        self._slots = slots
+        view = memoryview(mm)
+        self._views = [view]
+        pos = HEADER.size
+        self._hash = self._column(view, pos, 'I', slots)
+        pos += 4 * slots
+        self._offsets = self._column(view, pos, 'I', 2 * count + 1)
+        pos += 4 * (2 * count + 1)
+        self._masks = {}
+        for name in profiles:
+            self._masks[name] = self._column(view, pos, 'H', count)
+            pos += 2 * count
+        pos += -pos % 4
+        self._codes = view[pos:pos + width * count]
+        pos += width * count
+        pos += -pos % 4
+        self._heap = view[pos:pos + heap_len]
+        if len(self._heap) != heap_len:
+            raise ValueError()
+        self._views.extend([self._codes, self._heap])
+
+    def _column(self, view, pos, typecode, length):
+        size = array(typecode).itemsize * length
+        data = view[pos:pos + size]
+        if len(data) != size:
+            raise ValueError()
+        if sys.byteorder == 'little':
+            column = data.cast(typecode)
+            self._views.extend([data, column])
+            return column
+        # Big endian hosts read a swapped private copy
+        column = array(typecode)
+        column.frombytes(data)
+        data.release()
+        return _little_endian(column)
+
+    def close(self):
+        # Views of the map must be released before it can be closed
+        for view in reversed(getattr(self, '_views', ())):
+            view.release()
+        self._views = []
+        self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def code(self, i):
+        data = self._codes[i * self._width:(i + 1) * self._width]
+        return bytes(data).rstrip(b'\0').decode('utf-8')
+
+    def _heap_str(self, k):
+        return str(self._heap[self._offsets[k]:self._offsets[k + 1]],
+                   'utf-8')
+
+    def description(self, i):
+        return self._heap_str(2 * i)
+
+    def industries(self, i):
+        industries = self._heap_str(2 * i + 1)
+        return industries.split(INDUSTRY_SEP) if industries else []
+
+    def mask(self, i, profile=None):
+        """Class mask of label i in profile, the published one by default"""
+        return self._masks[profile or self.profile][i]
+
+    def masks(self, profile=None):
+        """Class masks of all labels in profile, a read-only sequence"""
+        return self._masks[profile or self.profile]
+
+    def find(self, code):
+        """Positions of the labels with a label code"""
+        key = code.encode('utf-8')
+        if len(key) > self._width:
+            return []
+        padded = key.ljust(self._width, b'\0')
+        width = self._width
+        slots = self._slots
+        slot = zlib.crc32(key) & (slots - 1)
+        found = []
+        while True:
+            entry = self._hash[slot]
+            if not entry:
+                return sorted(found)
+            i = entry - 1
+            if self._codes[i * width:(i + 1) * width] == padded:
+                found.append(i)
+            slot = (slot + 1) & (slots - 1)
+
+    def label(self, i):
+        """CargoLabel at position i"""
+        default = self._masks['default'][i]
+        variants = []
+        for name in nch.labels.NOTE_PROFILES:
+            mask = self._masks[name][i]
+            if mask != default:
+                variants.append((name, mask))
+        return nch.labels.CargoLabel(self.code(i), self.description(i),
+                                     default, self.industries(i), variants)
+
+    def lookup(self, code):
+        """CargoLabels with a label code"""
+        return [self.label(i) for i in self.find(code)]
+
+    def cargos(self, classes=None):
+        """Cargos with private copies of all the labels, for full queries.
+
+        Classes are not published, the built-in ones are used if not
+        given."""
+        cargos = nch.cargos.Cargos(
+            ignore_unknown_labels=self.ignore_unknown_labels,
+            profile=self.profile, classes=classes)
+        cargos.set_labels(
+            [self.label(i) for i in range(self._count)],
+            masks={name: array('H', column)
+                   for name, column in self._masks.items()})
+        return cargos
@@ -1,78 +1,343 @@
 #!/usr/bin/env python3
 
-from collections import OrderedDict
+from html.parser import HTMLParser
+import json
 import re
 import sys
 
-from bs4 import BeautifulSoup
-import requests
+import nch.classes
+import nch.timing
+import nch.webcache
+
+LABELS_URL = 'https://newgrf-specs.tt-wiki.net/wiki/CargoTypes'
+# Bump when parsing changes, so cached parse results are not reused
+PARSER_VERSION = 3
+# Characters fed to the parser at a time
+CHUNK_SIZE = 1 << 16
+
+LABEL_RE = re.compile(r'[A-Z0-9_]')
+CLASSES_RE = re.compile(r'[A-F0-9]{4}')
+SPECIAL_RE = re.compile(r'special cargos', re.IGNORECASE)
+VARIANT_RE = re.compile(r'\b(firs|ecs|yeti)[-:., ]+([A-F0-9]{4})',
+                        re.IGNORECASE)
+
+# Class mask profiles: the classes column of the wiki table, the classes
+# given in the notes for each industry set, and user overrides
+PROFILES = ('default', 'FIRS', 'ECS', 'YETI', 'custom')
+NOTE_PROFILES = ('FIRS', 'ECS', 'YETI')
 
 
 class CargoLabel:
-    def __init__(self, label, description, bitmask, industries):
-        self.label = label
+    """A cargo label, classes are derived from the bitmask.
+
+    variants are (profile, bitmask) pairs of the industry sets that use
+    other classes than the wiki table."""
+    __slots__ = ('label', 'description', 'bitmask', 'industries',
+                 'variants')
+
+    def __init__(self, label, description, bitmask, industries,
+                 variants=()):
+        self.label = sys.intern(label)
         self.description = description
         self.bitmask = bitmask
-        self.industries = industries
-        self.classes = set()
+        self.industries = intern_industries(industries)
+        self.variants = tuple(tuple(v) for v in variants) if variants else ()
+
+    def profile_mask(self, profile):
+        for name, mask in self.variants:
+            if name == profile:
+                return mask
+        return self.bitmask
 
     def __contains__(self, item):
-        return item in self.classes
+        return bool(self.bitmask & item.value)
 
-    def __iter__(self):
-        return iter(self.classes)
+    def astuple(self):
+        return (self.label, self.description, self.bitmask, self.industries,
+                self.variants)
 
     def __str__(self):
         return '{} - {}'.format(self.label, self.description)
 
 
-def fetch_labels(html_doc=None):
+def labels_to_rows(labels):
+    return [list(lb.astuple()) for lb in labels]
 
-    def match(row):
-        if len(row) >= 6 \
-                and re.match(r'[A-Z0-9_]', row[0]) \
-                and re.match(r'[A-F0-9]{4}', row[2]):
-            return True
-        return False
 
-    if not html_doc:
-        r = requests.get('https://newgrf-specs.tt-wiki.net/wiki/CargoTypes')
-        html_doc = r.text
-    soup = BeautifulSoup(html_doc, 'html.parser')
-    table = soup.find('table')
-    labels = []
-    for tr in table.find_all('tr'):
-        row = list(td.get_text().strip() for td in tr.find_all('td'))
-        if row and re.match(r'special cargos', row[0], re.IGNORECASE):
-            break
-        if not match(row):
-            continue
-        # Parsing the data is very brittle atm
-        label = row[0]
-        desc = row[1]
-        cc = int(row[2][:4], base=16)
-        # Some cargos have different classes in ecs/firs/yeti
-        # Some of them are in the notes of the wiki page,
-        # try to get the firs classes from these notes
-        if len(row) >= 8:
-            m = re.search(r'firs[-:., ]+([A-F0-9]{4})', row[7], re.IGNORECASE)
-            if m:
-                cc = int(m.group(1), base=16)
-        industries = [ind for ind in row[3:7] if ind != '']
-        labels.append(CargoLabel(label, desc, cc, industries))
+def labels_from_rows(rows):
+    return [CargoLabel(*row) for row in rows]
+
+
+def fetch_labels(html_doc=None, cache=None, cancelled=None):
+    """Parse labels from html_doc, or from the (cached) wiki page.
+
+    cancelled is polled while parsing, Cancelled is raised when it
+    returns true."""
+    if html_doc:
+        return parse_labels(html_doc, cancelled)
+    if cache is None:
+        cache = nch.webcache.PageCache()
+    with nch.timing.span('labels.fetch'):
+        page = cache.get(LABELS_URL)
+    return labels_of_page(page, cache, cancelled)
+
+
+def labels_of_page(page, cache, cancelled=None):
+    """Labels of a fetched page, parsed once per page body"""
+    kind = 'labels-v{}'.format(PARSER_VERSION)
+    rows = cache.load_derived(page.digest, kind)
+    if rows is not None:
+        return labels_from_rows(rows)
+    labels = parse_labels(page.text, cancelled)
+    cache.store_derived(page.digest, kind, labels_to_rows(labels))
+    return labels
+
+
+class LabelDiff:
+    """Changes from old to new labels, labels are matched by label code.
+
+    labels are the new labels, with the old label objects kept where
+    nothing changed. changed holds (old, new) pairs of labels with other
+    descriptions, classes or industries."""
+
+    def __init__(self):
+        self.labels = []
+        self.added = []
+        self.removed = []
+        self.changed = []
+
+    def described(self):
+        return [(a, b) for a, b in self.changed
+                if a.description != b.description]
+
+    def reclassed(self):
+        return [(a, b) for a, b in self.changed
+                if (a.bitmask, a.variants) != (b.bitmask, b.variants)]
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def summary(self):
+        if not self:
+            return 'no changes'
+        return '{} added, {} removed, {} descriptions and {} classes ' \
+               'changed'.format(len(self.added), len(self.removed),
+                                len(self.described()), len(self.reclassed()))
+
+    def lines(self):
+        out = ['+ {}'.format(lb) for lb in self.added]
+        out.extend('- {}'.format(lb) for lb in self.removed)
+        for a, b in self.changed:
+            if a.description != b.description:
+                out.append('~ {}: description {!r} -> {!r}'.format(
+                    b.label, a.description, b.description))
+            if (a.bitmask, a.variants) != (b.bitmask, b.variants):
+                out.append('~ {}: classes {:04X} -> {:04X}{}'.format(
+                    b.label, a.bitmask, b.bitmask, ''.join(
+                        ', {} {:04X}'.format(*v) for v in b.variants)))
+            if a.industries != b.industries:
+                out.append('~ {}: industries {} -> {}'.format(
+                    b.label, ', '.join(a.industries),
+                    ', '.join(b.industries)))
+        return out
+
+
+def keyed_labels(labels):
+    """(label code, occurrence) keys of labels, codes are not unique"""
+    seen = {}
+    for lb in labels:
+        n = seen.get(lb.label, 0)
+        seen[lb.label] = n + 1
+        yield (lb.label, n), lb
+
+
+def diff_labels(old, new):
+    """LabelDiff of old and new labels, in one pass over each"""
+    old_by_key = dict(keyed_labels(old))
+    diff = LabelDiff()
+    for key, lb in keyed_labels(new):
+        prev = old_by_key.pop(key, None)
+        if prev is None:
+            diff.added.append(lb)
+        elif prev.astuple() == lb.astuple():
+            lb = prev
+        else:
+            diff.changed.append((prev, lb))
+        diff.labels.append(lb)
+    diff.removed = list(old_by_key.values())
+    return diff
+
+
+_industries = {}
 
+
+def intern_industries(industries):
+    """Share one tuple between all labels with the same industries"""
+    industries = tuple(sys.intern(ind) for ind in industries)
+    return _industries.setdefault(industries, industries)
+
+
+class StopParsing(Exception):
+    pass
+
+
+class Cancelled(Exception):
+    pass
+
+
+class LabelTableParser(HTMLParser):
+    """Event based parser for the first table of the CargoTypes page.
+
+    Rows are turned into labels as soon as they close, and the parser
+    raises StopParsing at the special cargos row."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.labels = []
+        self.table_depth = 0
+        self.table_seen = False
+        self.row = None
+        self.cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'table':
+            if self.table_depth or not self.table_seen:
+                self.table_depth += 1
+                self.table_seen = True
+        elif not self.table_depth:
+            return
+        elif tag == 'tr':
+            self.end_row()
+            self.row = []
+        elif tag == 'td':
+            self.end_cell()
+            if self.row is None:
+                self.row = []
+            self.cell = []
+
+    def handle_endtag(self, tag):
+        if not self.table_depth:
+            return
+        if tag == 'td':
+            self.end_cell()
+        elif tag == 'tr':
+            self.end_row()
+        elif tag == 'table':
+            self.table_depth -= 1
+            if not self.table_depth:
+                self.end_row()
+                raise StopParsing()
+
+    def handle_data(self, data):
+        if self.cell is not None:
+            self.cell.append(data)
+
+    def end_cell(self):
+        if self.cell is not None:
+            self.row.append(''.join(self.cell).strip())
+            self.cell = None
+
+    def end_row(self):
+        self.end_cell()
+        row, self.row = self.row, None
+        if not row:
+            return
+        if SPECIAL_RE.match(row[0]):
+            raise StopParsing()
+        label = row_to_label(row)
+        if label:
+            self.labels.append(label)
+
+
+def row_to_label(row):
+    # Parsing the data is very brittle atm
+    if len(row) < 6 \
+            or not LABEL_RE.match(row[0]) \
+            or not CLASSES_RE.match(row[2]):
+        return None
+    label = row[0]
+    desc = row[1]
+    cc = int(row[2][:4], base=16)
+    # Some cargos have different classes in ecs/firs/yeti, some of them
+    # are in the notes of the wiki page
+    variants = {}
+    if len(row) >= 8:
+        for name, mask in VARIANT_RE.findall(row[7]):
+            variants.setdefault(name.upper(), int(mask, base=16))
+    industries = [ind for ind in row[3:7] if ind != '']
+    return CargoLabel(label, desc, cc, industries,
+                      [(name, variants[name]) for name in NOTE_PROFILES
+                       if variants.get(name, cc) != cc])
+
+
+def load_custom_masks(f, classes=None):
+    """Read custom profile masks from a json file object.
+
+    The file maps label codes to a list of NML class names of classes,
+    the built-in ones by default, or to the bitmask as an integer or a
+    hex string."""
+    data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError('Custom classes must map labels to classes')
+    by_name = {cl.name_nml: cl.value
+               for cl in classes or nch.classes.builtin}
+    masks = {}
+    for code, classes in data.items():
+        if isinstance(classes, int):
+            mask = classes
+        elif isinstance(classes, str):
+            mask = int(classes, base=16)
+        else:
+            mask = 0
+            for name in classes:
+                try:
+                    mask |= by_name[name]
+                except KeyError:
+                    raise ValueError('Unknown cargo class {}'.format(name))
+        masks[code] = mask & 0xFFFF
+    return masks
+
+
+def iter_labels(chunks):
+    """Parse labels from an iterable of html text chunks.
+
+    Labels are yielded as their rows close, the remaining chunks are not
+    read after the end of the label table."""
+    parser = LabelTableParser()
+    try:
+        for chunk in chunks:
+            parser.feed(chunk)
+            yield from parser.labels
+            parser.labels.clear()
+        parser.close()
+    except StopParsing:
+        pass
+    yield from parser.labels
+
+
+def iter_chunks(text, size=CHUNK_SIZE):
+    for i in range(0, len(text), size):
+        yield text[i:i + size]
+
+
+@nch.timing.timed('labels.parse')
+def parse_labels(html_doc, cancelled=None):
+    labels = []
+    for lb in iter_labels(iter_chunks(html_doc)):
+        if cancelled and cancelled():
+            raise Cancelled()
+        labels.append(lb)
     return labels
 
 
 def main():
     if len(sys.argv) > 1:
         with open(sys.argv[1], encoding='utf-8') as f:
-            html_doc = f.read()
+            lbs = list(iter_labels(iter(lambda: f.read(CHUNK_SIZE), '')))
     else:
-        html_doc = None
-    lbs = fetch_labels(html_doc)
+        lbs = fetch_labels()
     for lb in lbs:
-        print(lb.__dict__)
+        print(lb.astuple())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,156 @@
+"""Cargo class rules from
+https://newgrf-specs.tt-wiki.net/wiki/Action0/Cargos#CargoClasses_.2816.29
+compiled to predicates over (included mask, excluded mask)."""
+
+import csv
+
+import nch.classes as cc
+import nch.export
+
+INCLUDED = 0
+EXCLUDED = 1
+
+
+class Rule:
+    """Violated when the class is on `side`, and the included classes
+    masked with when_mask equal when_value"""
+    __slots__ = ('value', 'side', 'when_mask', 'when_value', 'message')
+
+    def __init__(self, value, side, when_mask, when_value, message):
+        self.value = value
+        self.side = side
+        self.when_mask = when_mask
+        self.when_value = when_value
+        self.message = message
+
+
+def _rules():
+    rules = [Rule(cc.non_pourable.value, INCLUDED, 0, 0,
+                  'Never include this class')]
+    for cl in [cc.passengers, cc.mail, cc.express, cc.armored, cc.bulk,
+               cc.piece_goods, cc.liquid]:
+        rules.append(Rule(cl.value, EXCLUDED, 0, 0,
+                          'Never exclude this class'))
+    for cl in [cc.refrigerated, cc.oversized]:
+        rules.append(Rule(cl.value, EXCLUDED, cc.piece_goods.value, 0,
+                          'Only exclude when Piece Goods is included'))
+    rules.append(Rule(cc.hazardous.value, EXCLUDED, 0, 0,
+                      'Only exclude when special wagons are provided'))
+    rules.append(Rule(cc.covered.value, EXCLUDED, cc.liquid.value,
+                      cc.liquid.value, 'Do not exclude for Liquid'))
+    for cl in [cc.powderized, cc.non_pourable]:
+        rules.append(Rule(cl.value, EXCLUDED, cc.bulk.value, 0,
+                          'Only exclude when Bulk is included'))
+    return rules
+
+
+def _index(rules):
+    """Rules in class order by side, and the classes with rules by side"""
+    by_side = [[], []]
+    masks = [0, 0]
+    for rule in sorted(rules, key=lambda r: r.value):
+        by_side[rule.side].append(rule)
+        masks[rule.side] |= rule.value
+    return by_side, masks
+
+
+RULES = _rules()
+_by_side, RULED_MASKS = _index(RULES)
+
+
+def check(incl, excl):
+    """Rule violations of a class mask pair, as (class value, message).
+
+    Violations are in class order, included classes first."""
+    out = []
+    for side, mask in ((INCLUDED, incl), (EXCLUDED, excl)):
+        if not mask & RULED_MASKS[side]:
+            continue
+        seen = 0
+        for rule in _by_side[side]:
+            if rule.value & mask and not rule.value & seen \
+                    and incl & rule.when_mask == rule.when_value:
+                # Only the first violated rule is reported per class
+                seen |= rule.value
+                out.append((rule.value, rule.message))
+    return out
+
+
+def check_class(value, side, incl, excl):
+    """First violated rule for one class, None if there is none"""
+    for rule in _by_side[side]:
+        if rule.value == value and incl & rule.when_mask == rule.when_value:
+            return rule.message
+    return None
+
+
+def check_many(pairs):
+    """Rule violations of many (included, excluded) mask pairs"""
+    return [check(incl, excl) for incl, excl in pairs]
+
+
+class LintError:
+    def __init__(self, line, name, subject, message):
+        self.line = line
+        self.name = name
+        self.subject = subject
+        self.message = message
+
+    def __str__(self):
+        where = '{}'.format(self.line)
+        if self.name:
+            where += ' ({})'.format(self.name)
+        return '{}: {}: {}'.format(where, self.subject, self.message)
+
+
+def split_field(field):
+    return [item.strip() for item in field.split(',') if item.strip()]
+
+
+def lint_tsv(f, names=False, known_labels=None, classes=None):
+    """Yield LintErrors of every row of a TSV refit sheet.
+
+    Rows are in the layout of the TSV export, with the vehicle name as
+    the first column if names is true. Labels are checked against
+    known_labels if given, class names against classes, the built-in
+    ones by default."""
+    classes = classes or cc.builtin
+    values = {cl.name_nml: cl.value for cl in classes}
+    for line, fields in enumerate(csv.reader(f, delimiter='\t'), 1):
+        if not any(field.strip() for field in fields):
+            continue
+        name = fields.pop(0) if names else ''
+        fields += [''] * (len(nch.export.PROPERTIES) - len(fields))
+        allow, disallow, cc_allow, cc_disallow = (
+            split_field(field) for field in fields[:4])
+
+        masks = []
+        for names_nml in (cc_allow, cc_disallow):
+            mask = 0
+            for name_nml in names_nml:
+                if name_nml not in values:
+                    yield LintError(line, name, name_nml,
+                                    'Unknown cargo class')
+                    continue
+                mask |= values[name_nml]
+            masks.append(mask)
+        incl, excl = masks
+        for value in classes:
+            if value.value & incl & excl:
+                yield LintError(line, name, value.name_nml,
+                                'Both included and excluded')
+        for label in sorted(set(allow) & set(disallow)):
+            yield LintError(line, name, label, 'Both allowed and disallowed')
+        if known_labels is not None:
+            for label in allow + disallow:
+                if label not in known_labels:
+                    yield LintError(line, name, label, 'Unknown cargo label')
+        for value, message in check(incl, excl):
+            yield LintError(line, name, cc_name(value, classes), message)
+
+
+def cc_name(value, classes=None):
+    for cl in classes or cc.builtin:
+        if cl.value == value:
+            return cl.name_nml
+    return hex(value)
@@ -0,0 +1,256 @@
+"""Scanner for the labels and classes used by an NML project.
+
+Source files are memory mapped and matched with one regex pass, many
+files are scanned in worker processes. Results are cached per file by
+modification time and size, so re-runs only scan changed files."""
+
+import hashlib
+import json
+import mmap
+import os
+import re
+
+import nch
+import nch.classes
+import nch.timing
+
+EXTENSIONS = ('.nml', '.pnml')
+# Bump when scan results change, so cached results are not reused
+SCAN_VERSION = 2
+# Below this many bytes to scan, starting worker processes costs more
+# than it saves
+POOL_BYTES = 1 << 22
+
+SCAN_RE = re.compile(rb'''
+      (?P<comment>//[^\n]*|/\*.*?\*/)
+    | \bcargotable\s*\{(?P<table>[^}]*)\}
+    | \b(?P<lprop>cargo_(?:allow|disallow)_refit)
+        \s*:\s*\[(?P<labels>[^\]]*)\]
+    | \b(?P<cprop>(?:non_)?refittable_cargo_classes)
+        \s*:\s*(?P<classes>[^;]*);
+    | "(?P<string>[A-Za-z0-9_]{4})"
+    | "[^"\n]*"
+    | \b(?P<word>[A-Z0-9_]{4})\b
+''', re.DOTALL | re.VERBOSE)
+COMMENT_RE = re.compile(rb'//[^\n]*|/\*.*?\*/', re.DOTALL)
+ITEM_RE = re.compile(rb'\s*(?:"([A-Za-z0-9_]{4})"|([A-Z0-9_]{4}))\s*')
+CLASS_RE = re.compile(rb'\b(?:CC_\w+|NO_CARGO_CLASS)\b')
+
+
+def _blank(m):
+    # Same length and newlines, so offsets and lines stay valid
+    return re.sub(rb'[^\n]', b' ', m.group())
+
+
+def _items(body):
+    """(offset, label) of the labels of a comma separated list.
+
+    Comments are dropped, items that are not a quoted or bare label,
+    like expressions, are skipped."""
+    body = COMMENT_RE.sub(_blank, body)
+    out = []
+    start = 0
+    for item in body.split(b','):
+        m = ITEM_RE.fullmatch(item)
+        if m:
+            group = 1 if m.group(1) else 2
+            out.append((start + m.start(group),
+                        m.group(group).decode('ascii')))
+        start += len(item) + 1
+    return out
+
+
+def scan_data(data):
+    """Labels and classes used in NML source data (bytes or a memory map).
+
+    Returns a json serializable dict:
+        cargotable  [line, label] of the cargotable blocks, in order
+        refs        [line, property, label] of the refit label lists
+        classes     [line, property, class name] of the class properties
+        words       other label like words, the labels referenced elsewhere
+    """
+    cargotable = []
+    refs = []
+    classes = []
+    words = set()
+    line = 1
+    pos = 0
+
+    def line_of(start):
+        # Lines are only counted up to the labels, slices of a memory map
+        # are bytes
+        nonlocal line, pos
+        line += data[pos:start].count(b'\n')
+        pos = start
+        return line
+
+    for m in SCAN_RE.finditer(data):
+        kind = m.lastgroup
+        if kind == 'word' or kind == 'string':
+            words.add(m.group(kind).decode('ascii'))
+        elif kind == 'table':
+            start = m.start('table')
+            cargotable.extend([line_of(start + offset), label]
+                              for offset, label in _items(m.group('table')))
+        elif kind == 'labels':
+            start = m.start('labels')
+            prop = m.group('lprop').decode('ascii')
+            refs.extend([line_of(start + offset), prop, label]
+                        for offset, label in _items(m.group('labels')))
+        elif kind == 'classes':
+            at = line_of(m.start())
+            prop = m.group('cprop').decode('ascii')
+            classes.extend([at, prop, name.decode('ascii')]
+                           for name in CLASS_RE.findall(m.group('classes')))
+    return {'cargotable': cargotable, 'refs': refs, 'classes': classes,
+            'words': sorted(words)}
+
+
+def scan_file(path):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return scan_data(b'')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return scan_data(mm)
+
+
+def iter_sources(root, extensions=EXTENSIONS):
+    """Paths of the source files under root relative to it, sorted"""
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        for name in filenames:
+            if name.endswith(extensions):
+                paths.append(os.path.relpath(os.path.join(dirpath, name),
+                                             root))
+    return sorted(paths)
+
+
+def _stat_key(st):
+    return [st.st_mtime_ns, st.st_size]
+
+
+def cache_path(root):
+    digest = hashlib.sha256(
+        os.path.abspath(root).encode('utf-8')).hexdigest()
+    return os.path.join(nch.CACHE_DIR, 'scan', digest + '.json')
+
+
+def load_cache(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get('version') != SCAN_VERSION:
+        return {}
+    return data.get('files', {})
+
+
+def save_cache(path, files):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'version': SCAN_VERSION, 'files': files}, f)
+    os.replace(tmp, path)
+
+
+def iter_scanned(paths, total_bytes, jobs=None):
+    """Yield scan results of paths in order, in worker processes if big"""
+    workers = jobs or os.cpu_count() or 1
+    if workers == 1 or total_bytes < POOL_BYTES:
+        for path in paths:
+            yield scan_file(path)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    chunksize = max(1, len(paths) // (4 * workers))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(scan_file, paths, chunksize=chunksize)
+
+
+class Project:
+    """Scan results of the source files of a project, by relative path"""
+
+    def __init__(self, root, files, scanned=0):
+        self.root = root
+        self.files = files
+        # Number of files scanned, the rest came from the cache
+        self.scanned = scanned
+
+    def cargotable(self):
+        """Labels of the project's cargotable blocks, in order"""
+        out = {}
+        for path in sorted(self.files):
+            table = self.files[path]['result']['cargotable']
+            out.update(dict.fromkeys(label for _, label in table))
+        return list(out)
+
+    def refs(self):
+        """(path, line, property, label) of the refit label lists"""
+        return [(path, line, prop, label)
+                for path in sorted(self.files)
+                for line, prop, label in self.files[path]['result']['refs']]
+
+    def classes(self):
+        """(path, line, property, class name) of the class properties"""
+        return [(path, line, prop, name)
+                for path in sorted(self.files)
+                for line, prop, name in self.files[path]['result']['classes']]
+
+    def needed_labels(self):
+        """Labels the project uses, in minimal cargotable order.
+
+        Labels of the refit lists are needed, cargotable labels are kept
+        if referenced anywhere else in the sources. Kept labels stay in
+        their cargotable order, new ones follow in order of first use."""
+        words = set()
+        for entry in self.files.values():
+            words.update(entry['result']['words'])
+        used = dict.fromkeys(label for _, _, _, label in self.refs())
+        needed = [label for label in self.cargotable()
+                  if label in used or label in words]
+        kept = set(needed)
+        needed.extend(label for label in used if label not in kept)
+        return needed
+
+    def unknown_labels(self, known):
+        """refs and cargotable labels that are not in known labels"""
+        out = [ref for ref in self.refs() if ref[3] not in known]
+        for path in sorted(self.files):
+            for line, label in self.files[path]['result']['cargotable']:
+                if label not in known:
+                    out.append((path, line, 'cargotable', label))
+        return out
+
+    def unknown_classes(self, classes=None):
+        """Class refs that are not in classes, the built-in ones by
+        default"""
+        names = {cl.name_nml for cl in classes or nch.classes.builtin}
+        names.add('NO_CARGO_CLASS')
+        return [ref for ref in self.classes() if ref[3] not in names]
+
+
+@nch.timing.timed('scan.project')
+def scan_project(root, extensions=EXTENSIONS, jobs=None, use_cache=True):
+    """Scan the source files under root, reusing cached results of
+    unchanged files"""
+    cache_file = cache_path(root)
+    cached = load_cache(cache_file) if use_cache else {}
+    files = {}
+    changed = []
+    total_bytes = 0
+    for rel in iter_sources(root, extensions):
+        st = os.stat(os.path.join(root, rel))
+        entry = cached.get(rel)
+        if entry is not None and entry['stat'] == _stat_key(st):
+            files[rel] = entry
+        else:
+            changed.append((rel, _stat_key(st)))
+            total_bytes += st.st_size
+    paths = [os.path.join(root, rel) for rel, _ in changed]
+    for (rel, key), result in zip(changed,
+                                  iter_scanned(paths, total_bytes, jobs)):
+        files[rel] = {'stat': key, 'result': result}
+    if use_cache and (changed or len(files) != len(cached)):
+        save_cache(cache_file, files)
+    return Project(root, files, scanned=len(changed))
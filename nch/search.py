@@ -0,0 +1,153 @@
+"""Substring search over label codes, descriptions and industries.
+
+Words are indexed by their prefixes up to MIN_GRAM - 1 characters, for
+short queries, and the whole text by its trigrams, for longer ones. Both
+map to label bitsets, like the Cargos query index."""
+
+from itertools import repeat
+import operator
+import re
+
+import nch.bits
+
+MIN_GRAM = 3
+WORD_RE = re.compile(r'\w+')
+# Keys of more labels than 1 / DENSE_RATIO get their bitsets with the
+# index, as do candidates checked against the texts in one pass
+DENSE_RATIO = 16
+FLAG_DIGITS = bytes.maketrans(b'\0\1', b'01')
+
+
+def narrows(old, new):
+    """True if the labels matching query new are among those matching old.
+
+    Holds when each word of old has a word in new matching no more
+    labels: the same word, a longer one containing it, or a longer
+    prefix while both are short enough to be matched as prefixes."""
+    new_tokens = new.lower().split()
+    for t in old.lower().split():
+        if not any(u == t or (len(t) >= MIN_GRAM and t in u)
+                   or (len(u) < MIN_GRAM and u.startswith(t))
+                   for u in new_tokens):
+            return False
+    return True
+
+
+def add_position(table, key, i):
+    positions = table.get(key)
+    if positions is None:
+        table[key] = [i]
+    else:
+        positions.append(i)
+
+
+class LabelIndex:
+    # Number of token results kept for narrowing down the next keystroke
+    cache_size = 256
+
+    def __init__(self, labels):
+        self.size = len(labels)
+        self.all_bits = (1 << self.size) - 1
+        self.texts = []
+        prefixes = {}
+        grams = {}
+        chunks = {}
+        lengths = range(1, MIN_GRAM)
+        for i, lb in enumerate(labels):
+            text = ' '.join((lb.label, lb.description)
+                            + tuple(lb.industries)).lower()
+            self.texts.append(text)
+            words = WORD_RE.findall(text)
+            for key in {w[:n] for w in words for n in lengths}:
+                add_position(prefixes, key, i)
+            for key in {text[k:k + MIN_GRAM]
+                        for k in range(len(text) - MIN_GRAM + 1)}:
+                add_position(grams, key, i)
+            for key in set(text.split()):
+                add_position(chunks, key, i)
+        # Texts from the last label on, so a row of flags reads as a bitset
+        self.reversed_texts = self.texts[::-1]
+        # Positions are turned into bitsets on first use, but for the
+        # keys of many labels, which would be slow to do while typing
+        self.prefixes = prefixes
+        self.grams = grams
+        self.bitsets = {}
+        self.cache = {}
+        dense = self.size // DENSE_RATIO
+        for table in (prefixes, grams):
+            for key, positions in table.items():
+                if len(positions) > dense:
+                    self._bits(table, key)
+        # Tokens have no spaces, so they match within one chunk of the
+        # text. Chunks of many labels, like industry names, settle most
+        # candidates of broad tokens without checking their texts
+        self.dense_chunks = [
+            (key, nch.bits.from_positions(positions, self.size))
+            for key, positions in chunks.items() if len(positions) > dense]
+
+    def _bits(self, table, key):
+        cache_key = (table is self.grams, key)
+        try:
+            return self.bitsets[cache_key]
+        except KeyError:
+            pass
+        bits = nch.bits.from_positions(table.get(key, ()), self.size)
+        self.bitsets[cache_key] = bits
+        return bits
+
+    def token_bits(self, token):
+        """Labels whose text contains token, as a bitset"""
+        try:
+            return self.cache[token]
+        except KeyError:
+            pass
+        if len(token) < MIN_GRAM:
+            bits = self._bits(self.prefixes, token)
+        else:
+            bits = self.all_bits
+            # The results for a shorter token narrow the search, which is
+            # the usual case while typing
+            for n in range(len(token) - 1, MIN_GRAM - 1, -1):
+                if token[:n] in self.cache:
+                    bits = self.cache[token[:n]]
+                    break
+            for k in range(len(token) - MIN_GRAM + 1):
+                bits &= self._bits(self.grams, token[k:k + MIN_GRAM])
+                if not bits:
+                    break
+            if len(token) > MIN_GRAM and bits:
+                # Trigrams can match in different places, check the text
+                bits &= self.containing(token, bits)
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[token] = bits
+        return bits
+
+    def containing(self, token, candidates):
+        """Labels among candidates whose text contains token"""
+        found = 0
+        for chunk, bits in self.dense_chunks:
+            if token in chunk:
+                found |= bits
+        found &= candidates
+        candidates &= ~found
+        if not candidates:
+            return found
+        if nch.bits.count(candidates) > self.size // DENSE_RATIO:
+            # Checking all texts in C beats visiting many candidates
+            flags = bytes(map(operator.contains, self.reversed_texts,
+                              repeat(token)))
+            return found | candidates & int(
+                flags.translate(FLAG_DIGITS) or b'0', 2)
+        return found | nch.bits.from_positions(
+            (i for i in nch.bits.iter_positions(candidates)
+             if token in self.texts[i]), self.size)
+
+    def search(self, query):
+        """Labels matching all words of the query, as a bitset"""
+        bits = self.all_bits
+        for token in query.lower().split():
+            bits &= self.token_bits(token)
+            if not bits:
+                break
+        return bits
@@ -0,0 +1,323 @@
+"""Local query daemon, keeping one Cargos in memory for build scripts.
+
+Requests are JSON batches, a list of query objects with an "op" and its
+arguments, answered with a list of {"ok": true, "result": ...} or
+{"ok": false, "error": ...} in the same order. Batches are POSTed to
+http://127.0.0.1:PORT/query, or sent one per line over a Unix socket.
+
+Queries run concurrently, a refresh builds new Cargos aside and swaps
+them in with one assignment, so queries see either the old or the new
+labels."""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import signal
+import socket
+import socketserver
+import stat
+import threading
+
+import nch
+import nch.export
+import nch.rules
+import nch.snapshot
+import nch.timing
+
+DEFAULT_PORT = 8787
+# Largest request body accepted over HTTP
+MAX_REQUEST = 1 << 24
+
+
+class QueryError(Exception):
+    pass
+
+
+def label_info(cargos, lb):
+    return {
+        'label': lb.label,
+        'description': lb.description,
+        'classes': [cl.name_nml for cl in cargos.classes_of(
+            cargos.masks[cargos.label_positions[lb]])],
+        'industries': list(lb.industries),
+    }
+
+
+class Service:
+    """Answers queries against the current Cargos"""
+
+    def __init__(self, cargos):
+        self.cargos = cargos
+        self.refresh_lock = threading.Lock()
+        self.ops = {
+            'label': self.op_label,
+            'labels': self.op_labels,
+            'classes': self.op_classes,
+            'effective_refit': self.op_effective_refit,
+            'check': self.op_check,
+            'solve': self.op_solve,
+            'nml': self.op_nml,
+            'tsv': self.op_tsv,
+            'cargotable': self.op_cargotable,
+            'refresh': self.op_refresh,
+        }
+
+    def strings(self, query, key):
+        """List of strings argument, empty when not given"""
+        value = query.get(key, [])
+        if not isinstance(value, list) \
+                or not all(isinstance(v, str) for v in value):
+            raise QueryError('{} must be a list of strings'.format(key))
+        return value
+
+    def string(self, query, key, default=None):
+        value = query.get(key, default)
+        if value is not default and not isinstance(value, str):
+            raise QueryError('{} must be a string'.format(key))
+        return value
+
+    def cargos_for(self, query):
+        # Read once, a refresh may swap self.cargos at any time
+        cargos = self.cargos
+        profile = self.string(query, 'profile')
+        if profile and profile != cargos.profile:
+            cargos = cargos.view(profile)
+        return cargos
+
+    def class_mask(self, cargos, query, key):
+        names = self.strings(query, key)
+        known = {cl.name_nml for cl in cargos.classes}
+        for name in names:
+            if name not in known:
+                raise QueryError('Unknown cargo class {}'.format(name))
+        return cargos.class_mask_of_names(names)
+
+    def op_label(self, cargos, query):
+        """Labels with the given codes"""
+        return [label_info(cargos, cargos.labels[i])
+                for code in self.strings(query, 'codes')
+                for i in cargos.code_positions.get(code, ())]
+
+    def op_labels(self, cargos, query):
+        """Label codes matching classes"""
+        bits = cargos.match_labels(
+            self.class_mask(cargos, query, 'classes'),
+            self.string(query, 'mode', 'ANY'))
+        return [lb.label for lb in cargos.labels_of(bits)]
+
+    def op_classes(self, cargos, query):
+        """Class names matching labels"""
+        bits = cargos.code_bits(self.strings(query, 'labels'))
+        mask = cargos.match_classes(bits, self.string(query, 'mode', 'ANY'))
+        return [cl.name_nml for cl in cargos.classes_of(mask)]
+
+    def op_effective_refit(self, cargos, query):
+        bits = cargos.effective_refit(
+            self.strings(query, 'cargo_allow_refit'),
+            self.strings(query, 'cargo_disallow_refit'),
+            self.class_mask(cargos, query, 'refittable_cargo_classes'),
+            self.class_mask(cargos, query, 'non_refittable_cargo_classes'))
+        return [lb.label for lb in cargos.labels_of(bits)]
+
+    def op_check(self, cargos, query):
+        """Class rule violations of included and excluded classes"""
+        return [[nch.rules.cc_name(value, cargos.classes), message]
+                for value, message in nch.rules.check(
+                    self.class_mask(cargos, query, 'included'),
+                    self.class_mask(cargos, query, 'excluded'))]
+
+    def op_solve(self, cargos, query):
+        """Shortest refit properties for exactly the labels"""
+        spec = cargos.solve_refit(self.strings(query, 'labels'))
+        return dict(zip(nch.export.PROPERTIES, spec.properties()))
+
+    def spec(self, cargos, query):
+        props = {p: self.strings(query, p) for p in nch.export.PROPERTIES}
+        return nch.export.RefitSpec(self.string(query, 'name', ''),
+                                    classes=cargos.classes, **props)
+
+    def op_nml(self, cargos, query):
+        return nch.export.format_spec_nml(self.spec(cargos, query))
+
+    def op_tsv(self, cargos, query):
+        return nch.export.format_spec_tsv(
+            self.spec(cargos, query), names=bool(query.get('names')))
+
+    def op_cargotable(self, cargos, query):
+        if query.get('labels') is None:
+            labels = [lb.label for lb in cargos.labels]
+        else:
+            labels = self.strings(query, 'labels')
+        return nch.export.cargotable(labels)
+
+    def op_refresh(self, cargos, query):
+        return self.refresh()
+
+    def refresh(self):
+        """Refresh the labels from the wiki, and swap them in"""
+        with self.refresh_lock:
+            # Refreshing a view leaves the Cargos of running queries alone
+            fresh = self.cargos.view(self.cargos.profile)
+            diff = fresh.refresh()
+            nch.snapshot.save(fresh, nch.CONFIG_PATH)
+            self.cargos = fresh
+        return diff.summary()
+
+    def query(self, query):
+        try:
+            if not isinstance(query, dict):
+                raise QueryError('Queries must be objects')
+            op = self.ops.get(self.string(query, 'op'))
+            if op is None:
+                raise QueryError('Unknown op {}'.format(query.get('op')))
+            return {'ok': True, 'result': op(self.cargos_for(query), query)}
+        except (QueryError, ValueError, KeyError, TypeError, OSError) as e:
+            # One bad query gives one error, the rest of the batch runs
+            return {'ok': False, 'error': str(e)}
+
+    @nch.timing.timed('serve.batch')
+    def batch(self, queries):
+        if not isinstance(queries, list):
+            queries = [queries]
+        return [self.query(q) for q in queries]
+
+    def handle_bytes(self, data):
+        try:
+            queries = json.loads(data)
+        except ValueError as e:
+            return json.dumps({'error': 'Bad JSON: {}'.format(e)})
+        return json.dumps(self.batch(queries))
+
+
+class HTTPHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes, without this the reply waits
+    # for the client's delayed ack on kept alive connections
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        if self.path != '/query':
+            self.send_error(404)
+            return
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            self.send_error(411)
+            return
+        if length < 0:
+            self.send_error(400, 'Bad Content-Length')
+            return
+        if length > MAX_REQUEST:
+            self.send_error(413)
+            return
+        body = self.server.service.handle_bytes(self.rfile.read(length))
+        self.reply(body.encode('utf-8'))
+
+    def reply(self, body):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, service, port=DEFAULT_PORT):
+        # Only local clients, there is no authentication
+        super().__init__(('127.0.0.1', port), HTTPHandler)
+        self.service = service
+
+
+class UnixHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            body = self.server.service.handle_bytes(line)
+            self.wfile.write(body.encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+def remove_stale_socket(path):
+    """Remove a socket file left behind by a daemon that is gone.
+
+    Raises OSError if a daemon still listens on it, or if path is not a
+    socket."""
+    if not os.path.exists(path):
+        return
+    if not stat.S_ISSOCK(os.stat(path).st_mode):
+        raise OSError('{} exists and is not a socket'.format(path))
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            pass
+        else:
+            raise OSError('A daemon is already listening on {}'.format(path))
+    os.remove(path)
+
+
+if hasattr(socketserver, 'ThreadingUnixStreamServer'):
+    class UnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+        def __init__(self, service, path):
+            remove_stale_socket(path)
+            super().__init__(path, UnixHandler)
+            self.service = service
+else:
+    UnixServer = None
+
+
+def serve(service, port=DEFAULT_PORT, socket_path=None):
+    """Serve until interrupted, over HTTP or a Unix socket"""
+    if socket_path:
+        if UnixServer is None:
+            raise OSError('Unix sockets are not supported here')
+        server = UnixServer(service, socket_path)
+    else:
+        server = HTTPServer(service, port)
+    def stop(signum, frame):
+        raise KeyboardInterrupt()
+
+    if threading.current_thread() is threading.main_thread():
+        # Stopped by a service manager, clean up as on Ctrl-C
+        signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def query(queries, port=DEFAULT_PORT, socket_path=None, timeout=30):
+    """Send a batch of queries to a running daemon, return the results"""
+    data = json.dumps(queries).encode('utf-8')
+    if socket_path:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            sock.sendall(data + b'\n')
+            with sock.makefile('rb') as f:
+                return json.loads(f.readline())
+    import http.client
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        conn.request('POST', '/query', data,
+                     {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        body = response.read()
+        if response.status != 200:
+            raise OSError('Daemon replied {} {}'.format(
+                response.status, response.reason))
+        return json.loads(body)
+    finally:
+        conn.close()
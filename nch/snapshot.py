@@ -0,0 +1,138 @@
+"""Compact, versioned snapshot of the cargo labels.
+
+Layout, all integers little endian:
+    header     magic, version, flags, label count, text length, profile
+               count, active profile
+    masks      uint16 class bitmask per label, one column per profile in
+               the order of nch.labels.PROFILES (padded to 4 bytes)
+    offsets    uint32 offsets into text, 3 per label + end offset
+    text       utf-8 label, description and industry strings
+
+Offsets are in characters of the decoded text, industries of one label
+are separated by INDUSTRY_SEP. Class relations are not stored, they are
+derived from the masks."""
+
+from array import array
+import mmap
+import os
+import struct
+import sys
+import threading
+
+import nch.cargos
+import nch.labels
+
+MAGIC = b'NCHS'
+VERSION = 2
+HEADER = struct.Struct('<4sHHIIHH')
+INDUSTRY_SEP = '\x1f'
+FLAG_IGNORE_UNKNOWN = 0x1
+
+
+def _little_endian(arr):
+    if sys.byteorder != 'little':
+        arr.byteswap()
+    return arr
+
+
+def dumps(cargos):
+    profiles = nch.labels.PROFILES
+    masks = array('H')
+    for name in profiles:
+        masks.extend(cargos.profiles[name].masks)
+    offsets = array('I')
+    parts = []
+    pos = 0
+    for lb in cargos.labels:
+        for s in (lb.label, lb.description,
+                  INDUSTRY_SEP.join(lb.industries)):
+            offsets.append(pos)
+            parts.append(s)
+            pos += len(s)
+    offsets.append(pos)
+    text = ''.join(parts).encode('utf-8')
+    flags = FLAG_IGNORE_UNKNOWN if cargos.ignore_unknown_labels else 0
+    header = HEADER.pack(MAGIC, VERSION, flags, len(cargos.labels),
+                         len(text), len(profiles),
+                         profiles.index(cargos.profile))
+    masks_bytes = _little_endian(masks).tobytes()
+    padding = b'\0' * (-len(masks_bytes) % 4)
+    return b''.join([header, masks_bytes, padding,
+                     _little_endian(offsets).tobytes(), text])
+
+
+def loads(data, classes=None):
+    """Build Cargos of classes from snapshot data (bytes or a memory map).
+
+    Classes are not stored, the built-in ones are used if not given.
+    Returns None if the data is not a complete snapshot of a known
+    version."""
+    if len(data) < HEADER.size:
+        return None
+    magic, version, flags, count, text_len, columns, active = \
+        HEADER.unpack_from(data, 0)
+    profiles = nch.labels.PROFILES
+    if magic != MAGIC or version != VERSION \
+            or columns != len(profiles) or active >= columns:
+        return None
+    pos = HEADER.size
+    masks_len = 2 * columns * count
+    masks_len += -(pos + masks_len) % 4
+    offsets_len = 4 * (3 * count + 1)
+    if len(data) < pos + masks_len + offsets_len + text_len:
+        # Truncated, reading on would index past the data
+        return None
+    all_masks = array('H')
+    all_masks.frombytes(data[pos:pos + 2 * columns * count])
+    pos += 2 * columns * count
+    pos += -pos % 4
+    offsets = array('I')
+    offsets.frombytes(data[pos:pos + 4 * (3 * count + 1)])
+    pos += 4 * (3 * count + 1)
+    text = bytes(data[pos:pos + text_len]).decode('utf-8')
+    _little_endian(all_masks)
+    _little_endian(offsets)
+    masks = {name: all_masks[k * count:(k + 1) * count]
+             for k, name in enumerate(profiles)}
+
+    # Labels keep the classes of the industry sets that differ
+    default = masks['default']
+    variants = [[] for _ in range(count)]
+    for name in nch.labels.NOTE_PROFILES:
+        column = masks[name]
+        for i, (a, b) in enumerate(zip(default, column)):
+            if a != b:
+                variants[i].append((name, b))
+    labels = []
+    for i, mask in enumerate(default):
+        o = 3 * i
+        industries = text[offsets[o + 2]:offsets[o + 3]]
+        labels.append(nch.labels.CargoLabel(
+            text[offsets[o]:offsets[o + 1]],
+            text[offsets[o + 1]:offsets[o + 2]],
+            mask,
+            industries.split(INDUSTRY_SEP) if industries else [],
+            variants[i]))
+    cargos = nch.cargos.Cargos(
+        ignore_unknown_labels=bool(flags & FLAG_IGNORE_UNKNOWN),
+        profile=profiles[active], classes=classes)
+    cargos.set_labels(labels, masks=masks)
+    return cargos
+
+
+def save(cargos, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Own temporary file per writer, concurrent saves can't interleave
+    tmp = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+    with open(tmp, 'wb') as f:
+        f.write(dumps(cargos))
+    os.replace(tmp, path)
+
+
+def load(path, classes=None):
+    try:
+        with open(path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return loads(mm, classes)
+    except (OSError, ValueError, struct.error, UnicodeDecodeError):
+        return None
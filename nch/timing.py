@@ -0,0 +1,126 @@
+"""Timing of named phases, for finding out where the time goes.
+
+Disabled unless the NCH_TIMING environment variable is set, or enable()
+is called (nch --timing). Its value is the file the report is written to
+at exit, or - for stderr. The report is json with the count, total and
+percentiles of each phase, and a latency histogram."""
+
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+# Upper bounds of the histogram buckets, in milliseconds
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000,
+           2500, 5000, 10000)
+
+enabled = False
+_durations = {}
+_lock = threading.Lock()
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def span(name):
+    """Context manager timing the phase name"""
+    if not enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def timed(name):
+    """Decorator timing every call as the phase name"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def record(name, seconds):
+    with _lock:
+        _durations.setdefault(name, []).append(seconds)
+
+
+def report():
+    out = {}
+    with _lock:
+        items = [(name, sorted(d)) for name, d in _durations.items()]
+    for name, durations in sorted(items):
+        histogram = [0] * (len(BUCKETS) + 1)
+        for d in durations:
+            ms = 1000 * d
+            i = 0
+            while i < len(BUCKETS) and ms > BUCKETS[i]:
+                i += 1
+            histogram[i] += 1
+        n = len(durations)
+        out[name] = {
+            'count': n,
+            'total_ms': 1000 * sum(durations),
+            'min_ms': 1000 * durations[0],
+            'p50_ms': 1000 * durations[n // 2],
+            'p95_ms': 1000 * durations[min(n - 1, n * 95 // 100)],
+            'max_ms': 1000 * durations[-1],
+            'histogram': {
+                ('<={}'.format(b) if i < len(BUCKETS)
+                 else '>{}'.format(BUCKETS[-1])): c
+                for i, (b, c) in enumerate(
+                    zip(BUCKETS + (None,), histogram)) if c},
+        }
+    return out
+
+
+def dump(path):
+    data = json.dumps(report(), indent=2)
+    if path == '-':
+        sys.stderr.write(data + '\n')
+    else:
+        with open(path, 'w') as f:
+            f.write(data + '\n')
+
+
+def enable(path='-'):
+    """Start timing, and write the report to path at exit"""
+    global enabled
+    if not enabled:
+        atexit.register(dump, path)
+    enabled = True
+
+
+if os.environ.get('NCH_TIMING'):
+    enable(os.environ['NCH_TIMING'])
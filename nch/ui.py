@@ -1,62 +1,439 @@
 #!/usr/bin/env python3
 
-import csv
-import io
-import os
+from bisect import bisect_left
 import os.path
-import pickle
-import sys
+import queue
+import threading
 import tkinter as tk
-from tkinter import ttk
-import webbrowser
-
-from pkg_resources import resource_filename
+from tkinter import filedialog, ttk
 
 import nch
 import nch.cargos
+import nch.export
+import nch.fetch
+import nch.labels
+import nch.search
+import nch.snapshot
+import nch.timing
+import nch.widgets
 
 FILL = tk.N + tk.S + tk.W + tk.E
+# Labels inserted per event loop round when filling the listboxes
+FILL_CHUNK = 2000
+# Milliseconds between checks for background refresh results
+POLL_INTERVAL = 50
+# Milliseconds of no typing before the label lists are filtered
+FILTER_DELAY = 100
 
 
 def save_config(data):
-    os.makedirs(os.path.dirname(nch.CONFIG_PATH), exist_ok=True)
-    with open(nch.CONFIG_PATH, 'wb') as f:
-        pickle.dump(data, f)
+    nch.snapshot.save(data, nch.CONFIG_PATH)
+
+
+def load_config(classes=None):
+    return nch.snapshot.load(nch.CONFIG_PATH, classes)
 
 
-def load_config():
+def refresh_worker(ignore_unknown_labels, profile, custom_masks, previous,
+                   cancel, results):
+    """Fetch labels into new Cargos in a worker thread.
+
+    Never touches Tk or the config file, progress and the result are put
+    to the results queue as (kind, value) tuples. The Tk thread saves the
+    result, so saves never race."""
     try:
-        with open(nch.CONFIG_PATH, 'rb') as f:
-            data = pickle.load(f)
-    except (EOFError, IOError):
-        data = None
-    return data
+        results.put(('status', 'Fetching and parsing labels...'))
+        cargos = nch.cargos.Cargos(ignore_unknown_labels=ignore_unknown_labels,
+                                   profile=profile, custom_masks=custom_masks)
+        diff = cargos.refresh(cancelled=cancel.is_set, previous=previous)
+        results.put(('status', 'Indexing labels...'))
+        cargos.build_search_index()
+    except nch.labels.Cancelled:
+        results.put(('cancelled', None))
+    except Exception as e:
+        results.put(('error', e))
+    else:
+        results.put(('done', (cargos, diff)))
+
+
+def index_runs(indices):
+    """Group sorted indices into (first, last) runs of consecutive indices"""
+    runs = []
+    for i in indices:
+        if runs and runs[-1][1] == i - 1:
+            runs[-1][1] = i
+        else:
+            runs.append([i, i])
+    return [tuple(r) for r in runs]
+
+
+class ClipboardWriter:
+    """File like object appending to the clipboard of a widget.
+
+    Writes are buffered and appended in chunks, instead of one big string
+    or one call per write."""
+    chunk_size = 1 << 16
+
+    def __init__(self, widget):
+        self.widget = widget
+        self.parts = []
+        self.size = 0
+        widget.clipboard_clear()
+
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.chunk_size:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self.parts:
+            self.widget.clipboard_append(''.join(self.parts))
+            self.parts = []
+            self.size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+
+class ClassCounts:
+    """Number of selected labels in each class.
+
+    Counts are updated from the labels added to and removed from the
+    selection, and start over when the labels or their profile change."""
+
+    def __init__(self):
+        self.masks = None
+        self.selected = set()
+        self.counts = {}
+        # Class values of each class mask seen
+        self.values = {}
+
+    def update(self, cargos, selected):
+        if cargos.masks is not self.masks:
+            self.masks = cargos.masks
+            self.selected = set()
+            self.counts = {}
+            self.values = {}
+        positions = cargos.label_positions
+        for labels, step in ((self.selected - selected, -1),
+                             (selected - self.selected, 1)):
+            for lb in labels:
+                mask = self.masks[positions[lb]]
+                try:
+                    values = self.values[mask]
+                except KeyError:
+                    values = self.values[mask] = [
+                        cl.value for cl in cargos.classes if mask & cl.value]
+                for value in values:
+                    self.counts[value] = self.counts.get(value, 0) + step
+        self.selected = selected
+        return self.counts
+
+
+class ListboxModel:
+    """Python side view of a listbox's contents.
+
+    Elements are kept sorted by their key in `order`, changes are applied
+    to the listbox as inserts and deletes of consecutive runs. When a
+    filter is set, only the elements it accepts are shown, but all
+    elements stay in the model."""
+
+    def __init__(self, listbox, order):
+        self.listbox = listbox
+        self.order = order
+        self.elements = []
+        self.accept = None
+        # Shown elements, one per listbox row
+        self.shown = []
+        self.keys = []
+        self.index = {}
+
+    def __len__(self):
+        return len(self.elements)
+
+    def _reindex(self):
+        self.keys = [self.order[e] for e in self.shown]
+        self.index = {e: i for i, e in enumerate(self.shown)}
+
+    def _accepted(self, elements):
+        if self.accept is None:
+            return list(elements)
+        return [e for e in elements if self.accept(e)]
+
+    def clear(self):
+        self.listbox.delete(0, tk.END)
+        self.elements = []
+        self.shown = []
+        self._reindex()
+
+    def set(self, elements):
+        """Replace the contents, elements must be sorted"""
+        self.clear()
+        self.extend(elements)
+
+    def set_filter(self, accept, narrow=False):
+        """Show only elements accept returns true for, None shows all.
+
+        narrow tells that accept only rejects more elements than the
+        current filter, so only the shown rows are checked."""
+        self.accept = accept
+        if narrow and accept is not None:
+            rows = [i for i, e in enumerate(self.shown) if not accept(e)]
+            if rows:
+                self._delete_rows(rows)
+                self.shown = [e for e in self.shown if accept(e)]
+                self._reindex()
+            return
+        self.listbox.delete(0, tk.END)
+        self.shown = self._accepted(self.elements)
+        if self.shown:
+            self.listbox.insert(tk.END, *self.shown)
+        self._reindex()
+
+    def extend(self, elements):
+        """Append elements sorting after all current elements"""
+        elements = list(elements)
+        self.elements.extend(elements)
+        shown = self._accepted(elements)
+        if shown:
+            self.listbox.insert(tk.END, *shown)
+        self.shown.extend(shown)
+        self._reindex()
+
+    def _delete_rows(self, rows):
+        if isinstance(self.listbox, nch.widgets.VirtualList):
+            # One pass instead of one per run
+            self.listbox.delete_rows(rows)
+        else:
+            for first, last in reversed(index_runs(rows)):
+                self.listbox.delete(first, last)
+
+    def remove(self, rows):
+        """Remove elements shown at rows, return them in sorted order"""
+        rows = sorted(set(rows))
+        removed = [self.shown[i] for i in rows]
+        self._delete_rows(rows)
+        gone = set(removed)
+        self.shown = [e for e in self.shown if e not in gone]
+        self.elements = [e for e in self.elements if e not in gone]
+        self._reindex()
+        return removed
+
+    def discard(self, elements):
+        """Remove elements, shown or not, return the ones that were here.
+
+        Keys are not recomputed, call reorder once the order is updated."""
+        gone = set(elements)
+        if not gone:
+            return []
+        removed = [e for e in self.elements if e in gone]
+        if removed:
+            self._delete_rows(
+                sorted(self.index[e] for e in removed if e in self.index))
+            self.shown = [e for e in self.shown if e not in gone]
+            self.elements = [e for e in self.elements if e not in gone]
+            self.index = {e: i for i, e in enumerate(self.shown)}
+        return removed
+
+    def reorder(self):
+        """Recompute the keys after the order changed, resorting the
+        contents only if the elements are no longer in order"""
+        # All elements, the filter may hide the ones out of order
+        keys = [self.order[e] for e in self.elements]
+        if any(a > b for a, b in zip(keys, keys[1:])):
+            self.set(sorted(self.elements, key=self.order.__getitem__))
+        else:
+            self._reindex()
+
+    def add(self, elements):
+        """Merge sorted elements into their sorted positions"""
+        elements = list(elements)
+        self.elements = merge_sorted(self.elements, elements, self.order)
+        merged = []
+        added = []
+        start = 0
+        for e in self._accepted(elements):
+            pos = bisect_left(self.keys, self.order[e], start)
+            merged.extend(self.shown[start:pos])
+            added.append(len(merged))
+            merged.append(e)
+            start = pos
+        merged.extend(self.shown[start:])
+        if isinstance(self.listbox, nch.widgets.VirtualList):
+            self.listbox.insert_rows(added, [merged[i] for i in added])
+        else:
+            # Inserting runs in ascending order, so earlier runs are
+            # already in place when later ones are inserted
+            for first, last in index_runs(added):
+                self.listbox.insert(first, *merged[first:last + 1])
+        self.shown = merged
+        self._reindex()
+
+
+def merge_sorted(a, b, order):
+    """Merge two lists sorted by their key in order"""
+    out = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if order[b[j]] < order[a[i]]:
+            out.append(b[j])
+            j += 1
+        else:
+            out.append(a[i])
+            i += 1
+    out.extend(a[i:])
+    out.extend(b[j:])
+    return out
 
 
 class App(tk.Frame):
     def __init__(self, master=None):
         self.focus_lb_selectcolor = tk.Listbox(None).cget('selectbackground')
         self.unfocus_lb_selectcolor = 'Gray'
-        self.init_cargos()
+        # Labels are loaded after the window is shown
+        self.clear_cargos()
         self.max_cc_lb_height = len(self.cargos.classes)
         tk.Frame.__init__(self, master)
         self.grid(sticky=FILL)
         self.top = self.winfo_toplevel()
+        self.refresh_cancel = None
+        self.fill_job = None
+        self.filter_job = None
+        # Filter text the label lists are filtered by
+        self.filter_text = ''
+        # Thread building the search index of the loaded labels
+        self.index_thread = None
         self.create_widgets()
         self.fill_unset()
+        self.after_idle(self.load_cargos)
+
+    def clear_cargos(self, classes=None):
+        self.cargos = nch.cargos.Cargos(ignore_unknown_labels=True,
+                                        classes=classes)
+        # Instant without labels, so filtering never waits for it
+        self.cargos.build_search_index()
 
-    def clear_cargos(self):
-        self.cargos = nch.cargos.Cargos(ignore_unknown_labels=True)
+    def start_refresh(self):
+        """Refresh labels in a worker thread, keeping the old ones usable"""
+        if self.refresh_cancel is not None:
+            return
+        self.refresh_cancel = threading.Event()
+        results = queue.Queue()
+        worker = threading.Thread(
+            target=refresh_worker, daemon=True,
+            args=(self.cargos.ignore_unknown_labels, self.cargos.profile,
+                  self.cargos.custom_masks, self.cargos.labels,
+                  self.refresh_cancel, results))
+        worker.start()
+        self.submenu.entryconfigure('Refresh labels', state=tk.DISABLED)
+        self.submenu.entryconfigure('Cancel refresh', state=tk.NORMAL)
+        self.after(POLL_INTERVAL, self.poll_refresh, results)
 
-    def refresh_cargos(self):
-        self.cargos.refresh()
+    def cancel_refresh(self):
+        if self.refresh_cancel is not None:
+            self.refresh_cancel.set()
+            self.set_status('Cancelling refresh...')
+
+    @nch.timing.timed('tk.poll_refresh')
+    def poll_refresh(self, results):
+        try:
+            while True:
+                kind, value = results.get_nowait()
+                if kind == 'status':
+                    self.set_status(value)
+                    continue
+                break
+        except queue.Empty:
+            self.after(POLL_INTERVAL, self.poll_refresh, results)
+            return
+        self.refresh_cancel = None
+        self.submenu.entryconfigure('Refresh labels', state=tk.NORMAL)
+        self.submenu.entryconfigure('Cancel refresh', state=tk.DISABLED)
+        if kind == 'done':
+            # Swap in the new labels only once they are complete
+            self.apply_refresh(*value)
+            try:
+                save_config(self.cargos)
+            except OSError as e:
+                self.set_status('Saving labels failed: {}'.format(e))
+        elif kind == 'cancelled':
+            self.set_status('Refresh cancelled')
+        else:
+            self.set_status('Refresh failed: {}'.format(value))
+
+    @nch.timing.timed('tk.apply_refresh')
+    def apply_refresh(self, cargos, diff):
+        """Swap in refreshed cargos, keeping the assignments of labels and
+        classes. Only rows of changed labels are touched."""
+        label_models = [self.models[lb] for lb in self.label_listboxes]
+        if self.fill_job is not None \
+                or not any(len(model) for model in label_models):
+            self.cargos = cargos
+            self.fill_unset(chunked=True)
+            self.set_status('Labels refreshed: {}'.format(diff.summary()))
+            return
+        # Changed labels go back where the old ones were
+        old = [a for a, _ in diff.changed]
+        owners = {}
+        for model in label_models:
+            for lb in model.discard(diff.removed + old):
+                owners[lb] = model
+        self.cargos = cargos
+        self.element_order.clear()
+        for i, label in enumerate(cargos.labels):
+            self.element_order[label] = i
+        for i, cc in enumerate(cargos.classes):
+            self.element_order[cc] = i
+        for model in label_models:
+            model.reorder()
+        unset = self.models[self.lb_label_unset]
+        moved = {}
+        for a, b in diff.changed:
+            moved.setdefault(owners.get(a, unset), []).append(b)
+        moved.setdefault(unset, []).extend(diff.added)
+        for model, labels in moved.items():
+            model.add(sorted(labels, key=self.element_order.__getitem__))
+        # Classes are matched by value
+        by_value = {cc.value: cc for cc in cargos.classes}
+        assigned = set()
+        for lb in (self.lb_cc_allow, self.lb_cc_disallow):
+            classes = [by_value[cc.value] for cc in self.models[lb].elements
+                       if cc.value in by_value]
+            assigned.update(classes)
+            self.models[lb].set(classes)
+        self.models[self.lb_cc_unset].set(
+            [cc for cc in cargos.classes if cc not in assigned])
+        self.selection_origin = None
+        if self.label_filter.get().strip():
+            self.set_label_filter()
+        self.profile_var.set(cargos.profile)
+        self.update_cc_logic_warnings()
+        self.update_effective_refit()
+        self.set_status('Labels refreshed: {}'.format(diff.summary()))
+
+    def set_status(self, text):
+        self.status.config(text=text)
 
     def init_cargos(self):
-        conf = load_config()
+        classes = nch.fetch.cached_classes()
+        conf = load_config(classes)
         if isinstance(conf, nch.cargos.Cargos):
             self.cargos = conf
         else:
-            self.clear_cargos()
+            self.clear_cargos(classes)
+
+    def load_cargos(self):
+        self.init_cargos()
+        # Index for the filter, built while the labels are filled in
+        self.index_thread = threading.Thread(
+            target=self.cargos.build_search_index, daemon=True)
+        self.index_thread.start()
+        self.fill_unset(chunked=True)
 
     def save_cargos(self):
         save_config(self.cargos)
@@ -70,33 +447,45 @@ class App(tk.Frame):
         self.top.update()
 
     def get_element_index(self, element, listbox):
-        for i, e in enumerate(self.get_all_elements(listbox)):
-            if e == element:
-                return i
-        raise KeyError('{} not found in {}'.format(element, listbox))
+        try:
+            return self.models[listbox].index[element]
+        except KeyError:
+            raise KeyError('{} not found in {}'.format(element, listbox))
 
     def get_element(self, index, listbox):
-        return self.element_mapping[listbox.get(index)]
+        return self.models[listbox].shown[index]
 
     def get_all_elements(self, *listboxes):
         out = []
         for lb in listboxes:
-            for i in range(0, lb.size()):
-                out.append(self.get_element(i, lb))
+            out.extend(self.models[lb].elements)
         return tuple(out)
 
     def get_selected_elements(self, *listboxes):
         out = []
         for lb in listboxes:
-            for i in lb.curselection():
-                out.append(self.get_element(i, lb))
+            shown = self.models[lb].shown
+            out.extend(shown[i] for i in lb.curselection())
         return tuple(out)
 
+    def select_elements(self, elements, listbox):
+        index = self.models[listbox].index
+        indices = sorted(index[e] for e in elements if e in index)
+        for first, last in index_runs(indices):
+            listbox.selection_set(first, last)
+
+    def deselect_elements(self, elements, listbox):
+        index = self.models[listbox].index
+        indices = sorted(index[e] for e in elements if e in index)
+        for first, last in index_runs(indices):
+            listbox.selection_clear(first, last)
+
     def button_command_factory(self, source_listbox, dest_listbox):
         def move(event=None):
-            for s in source_listbox.curselection()[::-1]:
-                dest_listbox.insert(tk.END, source_listbox.get(s))
-                source_listbox.delete(s)
+            moved = self.models[source_listbox].remove(
+                source_listbox.curselection())
+            self.models[dest_listbox].add(moved)
+            self.selection_origin = None
         return move
 
     def multi_command_factory(self, funcs):
@@ -106,17 +495,26 @@ class App(tk.Frame):
         return iter_funcs
 
     def hyperlink(self, parent, url, **kwargs):
+        def open_url(event):
+            import webbrowser
+            webbrowser.open_new(url)
         link = tk.Label(parent, fg='blue', cursor='hand2', **kwargs)
-        link.bind('<Button-1>', lambda e: webbrowser.open_new(url))
+        link.bind('<Button-1>', open_url)
         return link
 
     def listbox(self, parent, header, width=20, height=10, scrollbar=True,
-                stretchable=True):
-        """Make a listbox with header and (optional) scrollbar"""
+                stretchable=True, virtual=False):
+        """Make a listbox with header and (optional) scrollbar.
+
+        Virtual listboxes only draw the visible rows, for long lists."""
         frame = tk.Frame(parent)
         lab = tk.Label(frame, text=header)
-        lb = tk.Listbox(frame, activestyle='none', exportselection=0,
-                        width=width, height=height, selectmode=tk.EXTENDED)
+        if virtual:
+            lb = nch.widgets.VirtualList(frame, width=width, height=height)
+        else:
+            lb = tk.Listbox(frame, activestyle='none', exportselection=0,
+                            width=width, height=height,
+                            selectmode=tk.EXTENDED)
         if scrollbar:
             y_scroll = tk.Scrollbar(frame, command=lb.yview,
                                     orient=tk.VERTICAL)
@@ -137,10 +535,10 @@ class App(tk.Frame):
         fr = tk.Frame(frame)
 
         def add_button(spec, row, sticky):
-            cmd = self.multi_command_factory([
+            cmd = nch.timing.timed('tk.move')(self.multi_command_factory([
                 self.button_command_factory(spec[1], spec[2]),
-                self.sort_listboxes,
-                self.update_cc_logic_warnings])
+                self.update_cc_logic_warnings,
+                self.update_effective_refit]))
             btn = tk.Button(fr, text=spec[0], command=cmd)
             btn.grid(column=0, row=row, sticky=sticky)
             return btn
@@ -162,7 +560,8 @@ class App(tk.Frame):
     def create_widgets(self):
         # Window title
         self.top.title(nch.APPNAME)
-        self.top.iconbitmap(resource_filename(__name__, 'newgrf.ico'))
+        self.top.iconbitmap(
+            os.path.join(os.path.dirname(__file__), 'newgrf.ico'))
         # Make main window stretchable
         self.top.rowconfigure(0, weight=1)
         self.top.columnconfigure(0, weight=1)
@@ -178,11 +577,24 @@ class App(tk.Frame):
             self.busy, self.clear_cargos, self.save_cargos, self.fill_unset,
             self.notbusy])
         self.submenu.add_command(label='Clear labels', command=clear_cmd)
-        refresh_cmd = self.multi_command_factory([
-            self.busy, self.refresh_cargos, self.save_cargos, self.fill_unset,
-            self.notbusy])
-        self.submenu.add_command(label='Refresh labels', command=refresh_cmd)
+        self.submenu.add_command(label='Refresh labels',
+                                 command=self.start_refresh)
+        self.submenu.add_command(label='Cancel refresh',
+                                 command=self.cancel_refresh,
+                                 state=tk.DISABLED)
+        self.submenu.add_command(label='Save cargotable...',
+                                 command=self.save_cargotable)
+        self.submenu.add_command(label='Load custom classes...',
+                                 command=self.load_custom_masks)
         self.submenu.add_command(label='Exit', command=self.quit)
+        # Class mask profiles, switching does not refetch the labels
+        self.profile_menu = tk.Menu(self.menubar, tearoff=False)
+        self.menubar.add_cascade(label='Profile', menu=self.profile_menu)
+        self.profile_var = tk.StringVar(self, self.cargos.profile)
+        for name in nch.labels.PROFILES:
+            self.profile_menu.add_radiobutton(
+                label=name, value=name, variable=self.profile_var,
+                command=self.switch_profile)
 
 
         # Cargo labels
@@ -193,13 +605,13 @@ class App(tk.Frame):
         frame_labels = tk.Frame(self)
         frame_labels.grid(column=0, row=1, rowspan=2, sticky=FILL)
         fr, self.lb_label_allow = self.listbox(
-            frame_labels, 'cargo_allow_refit')
+            frame_labels, 'cargo_allow_refit', virtual=True)
         fr.grid(column=0, row=0, sticky=FILL)
         fr, self.lb_label_unset = self.listbox(
-            frame_labels, 'Unset cargos')
+            frame_labels, 'Unset cargos', virtual=True)
         fr.grid(column=2, row=0, sticky=FILL)
         fr, self.lb_label_disallow = self.listbox(
-            frame_labels, 'cargo_disallow_refit')
+            frame_labels, 'cargo_disallow_refit', virtual=True)
         fr.grid(column=4, row=0, sticky=FILL)
         fr, _, _ = self.movement_buttons(
             frame_labels,
@@ -211,6 +623,14 @@ class App(tk.Frame):
             ('->', self.lb_label_unset, self.lb_label_disallow),
             ('<-', self.lb_label_disallow, self.lb_label_unset))
         fr.grid(column=3, row=0)
+        # Type to filter, assignments are kept for hidden labels
+        fr = tk.Frame(frame_labels)
+        fr.grid(column=0, row=1, columnspan=5, sticky=tk.W+tk.E)
+        tk.Label(fr, text='Filter:').grid(column=0, row=0)
+        self.label_filter = tk.StringVar(self)
+        filter_entry = tk.Entry(fr, textvariable=self.label_filter)
+        filter_entry.grid(column=1, row=0, sticky=tk.W+tk.E)
+        fr.columnconfigure(1, weight=1)
         frame_labels.rowconfigure(0, weight=1)
         frame_labels.columnconfigure(0, weight=1)
         frame_labels.columnconfigure(2, weight=1)
@@ -251,15 +671,26 @@ class App(tk.Frame):
             self.lb_cc_allow, self.lb_cc_unset, self.lb_cc_disallow]
 
         self.all_listboxes = self.label_listboxes + self.cc_listboxes
+        self.element_order = {}
+        self.models = {lb: ListboxModel(lb, self.element_order)
+                       for lb in self.all_listboxes}
+        self.label_filter.trace_add('write', self.apply_filter)
 
         # Bind actions to selectors and listboxes
+        # Selection that the target listboxes' selection was set from
+        self.selection_origin = None
+        self.class_counts = ClassCounts()
         update_selected_ccs = self.update_listbox_selected_factory(
-            self.label_listboxes, self.cc_listboxes, self.cb_label.get)
+            self.label_listboxes, self.cc_listboxes, self.cb_label.get,
+            self.matching_classes, self.cargos_classes_of,
+            'tk.select_labels')
         self.cb_label.bind('<<ComboboxSelected>>', update_selected_ccs)
         for lb in self.label_listboxes:
             lb.bind('<<ListboxSelect>>', update_selected_ccs)
         update_selected_labels = self.update_listbox_selected_factory(
-            self.cc_listboxes, self.label_listboxes, self.cb_ccs.get)
+            self.cc_listboxes, self.label_listboxes, self.cb_ccs.get,
+            self.matching_labels, self.cargos_labels_of,
+            'tk.select_classes')
         self.cb_ccs.bind('<<ComboboxSelected>>', update_selected_labels)
         for lb in self.cc_listboxes:
             lb.bind('<<ListboxSelect>>', update_selected_labels)
@@ -277,9 +708,20 @@ class App(tk.Frame):
         self.lb_warnings = tk.Label(frame_war, height=13, anchor=tk.NW,
                                     justify=tk.LEFT)
         self.lb_warnings.grid(sticky=FILL)
+        # Labels the vehicle actually refits to
+        frame_eff = tk.Frame(frame_tb)
+        frame_eff.grid(column=0, row=2, sticky=tk.W)
+        self.lb_effective = tk.Label(frame_eff, anchor=tk.W)
+        self.lb_effective.grid(column=0, row=0, sticky=tk.W)
+        btn_effective = tk.Button(frame_eff, text='Select',
+                                  command=self.select_effective_refit)
+        btn_effective.grid(column=1, row=0, sticky=tk.W)
+        btn_solve = tk.Button(frame_eff, text='Solve for selected',
+                              command=self.solve_refit)
+        btn_solve.grid(column=2, row=0, sticky=tk.W)
         # Export buttons
         frame_btns = tk.Frame(frame_tb)
-        frame_btns.grid(column=0, row=2, sticky=tk.W)
+        frame_btns.grid(column=0, row=3, sticky=tk.W)
         btn_export_tsv = tk.Button(frame_btns, text='Copy to clipboard (TSV)',
                                    command=self.export_tsv)
         btn_export_tsv.grid(column=0, row=0, sticky=tk.S+tk.W)
@@ -292,149 +734,298 @@ class App(tk.Frame):
         frame_tb.rowconfigure(1, weight=1)
         frame_tb.columnconfigure(0, weight=1)
 
+        # Status bar
+        self.status = tk.Label(self, anchor=tk.W)
+        self.status.grid(column=0, row=3, columnspan=2, sticky=tk.W+tk.E)
+
+    def refit_properties(self):
+        """Labels and NML class names in the four refit property boxes"""
+        return [
+            [lb.label for lb in self.get_all_elements(self.lb_label_allow)],
+            [lb.label
+             for lb in self.get_all_elements(self.lb_label_disallow)],
+            [cc.name_nml for cc in self.get_all_elements(self.lb_cc_allow)],
+            [cc.name_nml
+             for cc in self.get_all_elements(self.lb_cc_disallow)]]
+
+    def effective_refit(self):
+        """Bitset of the labels the refit properties refit to"""
+        return self.cargos.effective_refit(
+            [lb.label for lb in self.get_all_elements(self.lb_label_allow)],
+            [lb.label
+             for lb in self.get_all_elements(self.lb_label_disallow)],
+            self.cargos.class_mask(self.get_all_elements(self.lb_cc_allow)),
+            self.cargos.class_mask(
+                self.get_all_elements(self.lb_cc_disallow)))
+
+    @nch.timing.timed('tk.switch_profile')
+    def switch_profile(self):
+        self.cargos.set_profile(self.profile_var.get())
+        self.update_effective_refit()
+        self.save_cargos()
+        self.set_status('Using {} classes'.format(self.cargos.profile))
+
+    def load_custom_masks(self):
+        path = filedialog.askopenfilename(
+            filetypes=[('JSON', '*.json'), ('All files', '*')])
+        if not path:
+            return
+        try:
+            with open(path, encoding='utf-8') as f:
+                masks = nch.labels.load_custom_masks(f, self.cargos.classes)
+        except (OSError, ValueError) as e:
+            self.set_status('Loading custom classes failed: {}'.format(e))
+            return
+        self.cargos.set_custom_masks(masks)
+        self.profile_var.set('custom')
+        self.switch_profile()
+
+    def update_effective_refit(self):
+        count = bin(self.effective_refit()).count('1')
+        self.lb_effective.config(
+            text='Refits to {} of {} labels'.format(
+                count, len(self.cargos.labels)))
+
+    def select_effective_refit(self):
+        labels = self.cargos.labels_of(self.effective_refit())
+        self.selection_origin = None
+        for lb in self.label_listboxes:
+            lb.selection_clear(0, tk.END)
+            self.select_elements(labels, lb)
+            lb.config(selectbackground=self.focus_lb_selectcolor)
+
+    @nch.timing.timed('tk.solve_refit')
+    def solve_refit(self):
+        """Fill the refit property boxes with the shortest properties that
+        refit to exactly the selected labels"""
+        if self.fill_job is not None:
+            self.set_status('Wait until the labels are filled')
+            return
+        labels = self.get_selected_elements(*self.label_listboxes)
+        if not labels:
+            self.set_status('Select the labels the vehicle should refit to')
+            return
+        spec = self.cargos.solve_refit(
+            list(dict.fromkeys(lb.label for lb in labels)))
+        allow = set(spec.cargo_allow_refit)
+        disallow = set(spec.cargo_disallow_refit)
+        self.models[self.lb_label_allow].set(
+            [lb for lb in self.cargos.labels if lb.label in allow])
+        self.models[self.lb_label_disallow].set(
+            [lb for lb in self.cargos.labels if lb.label in disallow])
+        self.models[self.lb_label_unset].set(
+            [lb for lb in self.cargos.labels
+             if lb.label not in allow and lb.label not in disallow])
+        incl = set(spec.refittable_cargo_classes)
+        excl = set(spec.non_refittable_cargo_classes)
+        self.models[self.lb_cc_allow].set(
+            [cc for cc in self.cargos.classes if cc.name_nml in incl])
+        self.models[self.lb_cc_disallow].set(
+            [cc for cc in self.cargos.classes if cc.name_nml in excl])
+        self.models[self.lb_cc_unset].set(
+            [cc for cc in self.cargos.classes
+             if cc.name_nml not in incl and cc.name_nml not in excl])
+        self.update_cc_logic_warnings()
+        self.update_effective_refit()
+        self.select_effective_refit()
+        self.set_status('{} classes and {} labels listed'.format(
+            len(incl) + len(excl), len(allow) + len(disallow)))
+
     def export_tsv(self):
-        row = []
-        row.append(', '.join(
-            lb.label for lb in self.get_all_elements(self.lb_label_allow)))
-        row.append(', '.join(
-            lb.label for lb in self.get_all_elements(self.lb_label_disallow)))
-        row.append(', '.join(
-            cc.name_nml for cc in self.get_all_elements(self.lb_cc_allow)))
-        row.append(', '.join(
-            cc.name_nml for cc in self.get_all_elements(self.lb_cc_disallow)))
-        # If last element is empty, it wont get pasted to google sheets
-        if row[-1] == '':
-            row[-1] = ' '
-
-        f = io.StringIO()
-        writer = csv.writer(f, delimiter='\t')
-        writer.writerow(row)
-        self.clipboard_clear()
-        self.clipboard_append(f.getvalue())
+        with ClipboardWriter(self) as out:
+            nch.export.write_tsv(
+                out, [nch.export.tsv_fields(*self.refit_properties())])
 
     def export_nml(self):
-        out = []
-        for spec in [(self.lb_label_allow, 'cargo_allow_refit'),
-                     (self.lb_label_disallow, 'cargo_disallow_refit')]:
-            cargos = ', '.join(
-                lb.label for lb in self.get_all_elements(spec[0]))
-            out.append('{}: [{}];'.format(spec[1], cargos))
-
-        for spec in [(self.lb_cc_allow, 'refittable_cargo_classes'),
-                     (self.lb_cc_disallow, 'non_refittable_cargo_classes')]:
-            ccs = ', '.join(
-                cc.name_nml for cc in self.get_all_elements(spec[0]))
-            if ccs:
-                ccs = 'bitmask({})'.format(ccs)
-            else:
-                ccs = 'NO_CARGO_CLASS'
-            out.append('{}: {};'.format(spec[1], ccs))
-        self.clipboard_clear()
-        self.clipboard_append('\n'.join(out))
+        with ClipboardWriter(self) as out:
+            nch.export.write_nml(out, *self.refit_properties())
 
     def export_cargotable(self):
-        labels = ', '.join([lbl.label for lbl in self.cargos.labels])
-        self.clipboard_clear()
-        self.clipboard_append('cargotable {{\n    {}\n}}'.format(labels))
+        with ClipboardWriter(self) as out:
+            nch.export.write_cargotable(
+                out, (lbl.label for lbl in self.cargos.labels))
 
-    def fill_unset(self):
+    def save_cargotable(self):
+        path = filedialog.asksaveasfilename(
+            defaultextension='.pnml',
+            filetypes=[('NML', '*.pnml *.nml'), ('All files', '*')])
+        if not path:
+            return
+        try:
+            with open(path, 'w', encoding='utf-8') as out:
+                nch.export.write_cargotable(
+                    out, (lbl.label for lbl in self.cargos.labels))
+                out.write('\n')
+        except OSError as e:
+            self.set_status('Saving cargotable failed: {}'.format(e))
+        else:
+            self.set_status('Saved cargotable to {}'.format(path))
+
+    @nch.timing.timed('ui.fill_unset')
+    def fill_unset(self, chunked=False):
+        """Put all labels and classes to the unset listboxes.
+
+        When chunked, labels are inserted over several event loop rounds
+        so the window stays responsive."""
+        if self.fill_job is not None:
+            self.after_cancel(self.fill_job)
+            self.fill_job = None
         for lb in self.all_listboxes:
-            lb.delete(0, tk.END)
-        # Assumes no label will ever have the same name as a class
-        self.element_mapping = {}
-        for label in self.cargos.labels:
-            self.lb_label_unset.insert(tk.END, label)
-            self.element_mapping[str(label)] = label
-        for cc in self.cargos.classes:
-            self.lb_cc_unset.insert(tk.END, cc)
-            self.element_mapping[str(cc)] = cc
-
-    def sort_listboxes(self):
-        def sort(listboxes, source):
-            for lb in listboxes:
-                listed = self.get_all_elements(lb)
-                lb.delete(0, tk.END)
-                for elem in source:
-                    if elem in listed:
-                        lb.insert(tk.END, elem)
-        label_boxes = [self.lb_label_allow, self.lb_label_unset,
-                       self.lb_label_disallow]
-        sort(label_boxes, self.cargos.labels)
-        cc_boxes = [self.lb_cc_allow, self.lb_cc_unset, self.lb_cc_disallow]
-        sort(cc_boxes, self.cargos.classes)
+            self.models[lb].clear()
+        self.selection_origin = None
+        # Listboxes are kept in the order of the cargos labels and classes
+        self.element_order.clear()
+        for i, label in enumerate(self.cargos.labels):
+            self.element_order[label] = i
+        for i, cc in enumerate(self.cargos.classes):
+            self.element_order[cc] = i
+        self.models[self.lb_cc_unset].set(self.cargos.classes)
+        self.profile_var.set(self.cargos.profile)
+        self.set_label_filter()
+        self.update_cc_logic_warnings()
+        self.update_effective_refit()
+        if chunked:
+            self.fill_labels_chunk(self.cargos.labels, 0)
+        else:
+            self.models[self.lb_label_unset].set(self.cargos.labels)
+            self.set_status('{} labels'.format(len(self.cargos.labels)))
+
+    @nch.timing.timed('tk.fill_labels_chunk')
+    def fill_labels_chunk(self, labels, start):
+        end = min(start + FILL_CHUNK, len(labels))
+        self.models[self.lb_label_unset].extend(labels[start:end])
+        if end < len(labels):
+            self.set_status('Filling labels {}/{}'.format(end, len(labels)))
+            self.fill_job = self.after(
+                1, self.fill_labels_chunk, labels, end)
+        else:
+            self.fill_job = None
+            self.set_status('{} labels'.format(len(labels)))
+
+    def label_filter_func(self, text):
+        """Membership test for the labels matching the filter text"""
+        if not text.strip():
+            return None
+        matches = set(self.cargos.labels_of(self.cargos.search(text)))
+        return matches.__contains__
+
+    def set_label_filter(self, narrow=False):
+        """Filter the label lists by the filter text.
+
+        With narrow, when the text only narrows down the last filter,
+        only the shown rows are filtered again."""
+        text = self.label_filter.get()
+        narrow = narrow and nch.search.narrows(self.filter_text, text)
+        self.filter_text = text
+        accept = self.label_filter_func(text)
+        self.selection_origin = None
+        for lb in self.label_listboxes:
+            self.models[lb].set_filter(accept, narrow)
+
+    def apply_filter(self, *args):
+        """Filter the label lists once typing pauses"""
+        if self.filter_job is not None:
+            self.after_cancel(self.filter_job)
+        self.filter_job = self.after(FILTER_DELAY, self.run_filter)
+
+    @nch.timing.timed('tk.filter')
+    def run_filter(self):
+        self.filter_job = None
+        if self.label_filter.get().strip() \
+                and self.cargos.search_index is None:
+            if self.index_thread is not None \
+                    and self.index_thread.is_alive():
+                # Still being built in the background, not on this thread
+                self.set_status('Indexing labels...')
+                self.filter_job = self.after(POLL_INTERVAL, self.run_filter)
+                return
+            # Nothing is building it, e.g. the labels were replaced
+            self.cargos.build_search_index()
+        self.set_label_filter(narrow=True)
+        shown = sum(len(self.models[lb].shown) for lb in self.label_listboxes)
+        self.set_status('{}/{} labels shown'.format(
+            shown, len(self.cargos.labels)))
+
+    def cargos_classes_of(self, mask):
+        return self.cargos.classes_of(mask)
+
+    def cargos_labels_of(self, bits):
+        return self.cargos.labels_of(bits)
+
+    def matching_classes(self, labels, mode):
+        """Class mask of the classes matching labels, from the per class
+        counts of the selected labels"""
+        if mode not in ('ANY', 'ALL', 'NONE'):
+            raise ValueError('Unknown selection mode {}'.format(mode))
+        counts = self.class_counts.update(self.cargos, labels)
+        mask = 0
+        for cl in self.cargos.classes:
+            n = counts.get(cl.value, 0)
+            if mode == 'ANY' and n \
+                    or mode == 'ALL' and labels and n == len(labels) \
+                    or mode == 'NONE' and not n:
+                mask |= cl.value
+        return mask
+
+    def matching_labels(self, classes, mode):
+        """Bitset of the labels matching classes"""
+        class_mask = self.cargos.class_mask(classes)
+        return self.cargos.match_labels(class_mask, mode)
 
     def update_listbox_selected_factory(
-            self, clicked_listboxes, target_listboxes, selection_func):
+            self, clicked_listboxes, target_listboxes, selection_func,
+            match_func, elements_of, timer):
+        """Event handler selecting the matches of the clicked listboxes'
+        selection in the target listboxes.
 
-        def update(event):
-            selection_mode = selection_func()
-            for tlb in target_listboxes:
-                tlb.selection_clear(0, tk.END)
-            seen_classes = set()
+        Bursts of events are handled once the event loop is idle. Matches
+        are bitsets, and only the rows whose match changed are updated
+        while no other selection change happened in between."""
+        state = {'job': None, 'matches': 0}
 
-            def any_selector():
-                for sel in self.get_selected_elements(*clicked_listboxes):
-                    # This is labels for classes, and vice versa
-                    seen_classes.update(sel)
-                for tlb in target_listboxes:
-                    for i in range(0, tlb.size()):
-                        if self.get_element(i, tlb) in seen_classes:
-                            tlb.selection_set(i)
-
-            def all_selector():
-                for sel in self.get_selected_elements(*clicked_listboxes):
-                    # This is labels for classes, and vice versa
-                    these_classes = set(sel)
-                    if not seen_classes:
-                        seen_classes.update(these_classes)
-                    elif these_classes.isdisjoint(seen_classes):
-                        return
-                    else:
-                        seen_classes.intersection_update(these_classes)
+        @nch.timing.timed(timer)
+        def run():
+            state['job'] = None
+            selection_mode = selection_func()
+            # This is classes for labels, and vice versa
+            matches = match_func(
+                set(self.get_selected_elements(*clicked_listboxes)),
+                selection_mode)
+            if self.selection_origin is state:
+                old = state['matches']
                 for tlb in target_listboxes:
-                    for i in range(0, tlb.size()):
-                        if self.get_element(i, tlb) in seen_classes:
-                            tlb.selection_set(i)
-
-            def none_selector():
-                for sel in self.get_selected_elements(*clicked_listboxes):
-                    # This is labels for classes, and vice versa
-                    seen_classes.update(sel)
+                    self.deselect_elements(elements_of(old & ~matches), tlb)
+                    self.select_elements(elements_of(matches & ~old), tlb)
+            else:
+                selected = elements_of(matches)
                 for tlb in target_listboxes:
-                    for i in range(0, tlb.size()):
-                        if self.get_element(i, tlb) not in seen_classes:
-                            tlb.selection_set(i)
-
-            selection_modes = {
-                'ANY': any_selector,
-                'ALL': all_selector,
-                'NONE': none_selector
-            }
-
-            selector_func = selection_modes[selection_mode]
-            selector_func()
+                    tlb.selection_clear(0, tk.END)
+                    self.select_elements(selected, tlb)
+            state['matches'] = matches
+            self.selection_origin = state
             for clb in clicked_listboxes:
                 clb.config(selectbackground=self.focus_lb_selectcolor)
             for tlb in target_listboxes:
                 tlb.config(selectbackground=self.unfocus_lb_selectcolor)
 
+        def update(event=None):
+            if state['job'] is None:
+                state['job'] = self.after_idle(run)
+
         return update
 
+    @nch.timing.timed('ui.warnings')
     def update_cc_logic_warnings(self):
-        warnings = []
-        exclusions = self.get_all_elements(self.lb_cc_disallow)
-        for included in self.get_all_elements(self.lb_cc_allow):
-            warning = self.cargos.check_inclusion(included, exclusions)
-            if warning:
-                warnings.append((included, warning))
-        inclusions = self.get_all_elements(self.lb_cc_allow)
-        for excluded in self.get_all_elements(self.lb_cc_disallow):
-            warning = self.cargos.check_exclusion(excluded, inclusions)
-            if warning:
-                warnings.append((excluded, warning))
+        warnings = self.cargos.check_classes(
+            self.get_all_elements(self.lb_cc_allow),
+            self.get_all_elements(self.lb_cc_disallow))
         lines = ['{}: {}'.format(w[0].name, w[1]) for w in warnings]
         self.lb_warnings.config(text='\n'.join(lines))
-        # Take care to run this AFTER all sorting and moving of elements
+        # Moved rows keep their item options, so reset the highlights first
+        for lb in self.cc_listboxes:
+            for i in range(0, lb.size()):
+                lb.itemconfigure(i, background='', selectforeground='')
+        # Take care to run this AFTER all moving of elements
         for w in warnings:
             for lb in [self.lb_cc_allow, self.lb_cc_disallow]:
                 try:
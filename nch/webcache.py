@@ -0,0 +1,136 @@
+"""On-disk cache for the wiki pages, revalidated with conditional requests.
+
+Page bodies and anything derived from them are stored by the sha256 of the
+body, so unchanged pages never need to be parsed again."""
+
+import hashlib
+import json
+import os
+
+import nch
+
+
+class CachedPage:
+    def __init__(self, url, text, digest, changed, from_cache):
+        self.url = url
+        self.text = text
+        self.digest = digest
+        # False when the server confirmed the cached copy is current
+        self.changed = changed
+        # True when served from the cache without a successful request
+        self.from_cache = from_cache
+
+
+class PageCache:
+    def __init__(self, path=None, timeout=30, session=None):
+        self.path = path or nch.CACHE_DIR
+        self.timeout = timeout
+        self.session = session
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _meta_file(self, url):
+        return self._file(hashlib.sha256(url.encode('utf-8')).hexdigest()
+                          + '.meta.json')
+
+    def _write(self, name, data):
+        os.makedirs(self.path, exist_ok=True)
+        tmp = self._file(name + '.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, self._file(name))
+
+    def _remove(self, name):
+        try:
+            os.remove(self._file(name))
+        except OSError:
+            pass
+
+    def load_meta(self, url):
+        try:
+            with open(self._meta_file(url), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load_body(self, digest):
+        try:
+            with open(self._file(digest + '.body'), 'rb') as f:
+                return f.read().decode('utf-8')
+        except OSError:
+            return None
+
+    def load_derived(self, digest, kind):
+        """Load data derived from a page body, e.g. parsed rows"""
+        try:
+            with open(self._file('{}.{}.json'.format(digest, kind)),
+                      encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def store_derived(self, digest, kind, data):
+        self._write('{}.{}.json'.format(digest, kind),
+                    json.dumps(data).encode('utf-8'))
+
+    def _forget(self, digest):
+        """Remove a body and everything derived from it"""
+        prefix = digest + '.'
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return
+        for name in names:
+            if name.startswith(prefix):
+                self._remove(name)
+
+    def get(self, url):
+        """Get a page, revalidating the cached copy if there is one.
+
+        When the request fails, the cached copy is served instead."""
+        meta = self.load_meta(url)
+        cached = None
+        headers = {}
+        if meta:
+            cached = self.load_body(meta['digest'])
+        if cached is not None:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        # Imported here, it is slow to import and rarely needed
+        import requests
+        session = self.session or requests
+        try:
+            r = session.get(url, headers=headers, timeout=self.timeout)
+            if r.status_code == 304 and cached is not None:
+                return CachedPage(url, cached, meta['digest'], changed=False,
+                                  from_cache=False)
+            r.raise_for_status()
+        except requests.RequestException:
+            if cached is None:
+                raise
+            return CachedPage(url, cached, meta['digest'], changed=False,
+                              from_cache=True)
+
+        body = r.content
+        digest = hashlib.sha256(body).hexdigest()
+        text = body.decode(r.encoding or 'utf-8', errors='replace')
+        if cached is None or digest != meta['digest']:
+            # Store the decoded text, so the cache does not depend on the
+            # charset of the response
+            self._write(digest + '.body', text.encode('utf-8'))
+        if meta and meta['digest'] != digest:
+            self._forget(meta['digest'])
+        new_meta = {
+            'url': url,
+            'digest': digest,
+            'etag': r.headers.get('ETag'),
+            'last_modified': r.headers.get('Last-Modified'),
+        }
+        self._write(os.path.basename(self._meta_file(url)),
+                    json.dumps(new_meta).encode('utf-8'))
+        changed = meta is None or meta['digest'] != digest
+        return CachedPage(url, text, digest, changed=changed,
+                          from_cache=False)
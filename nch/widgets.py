@@ -0,0 +1,399 @@
+"""Tk widgets"""
+
+from bisect import bisect_left, bisect_right
+import tkinter as tk
+import tkinter.font as tkfont
+
+
+class VirtualList(tk.Frame):
+    """Listbox that only draws the visible rows.
+
+    Implements the parts of the tk.Listbox interface the app uses, with
+    extended selection. Rows are kept in a Python list and drawn with
+    str(), the selection is a set of row indices."""
+
+    # Listbox options handled here instead of by the frame
+    list_options = ('selectbackground', 'selectforeground', 'background',
+                    'foreground', 'yscrollcommand')
+    item_options = ('background', 'foreground', 'selectbackground',
+                    'selectforeground')
+
+    def __init__(self, master=None, width=20, height=10, **kw):
+        reference = tk.Listbox(master)
+        self.options = {opt: reference.cget(opt) for opt in self.list_options
+                        if opt != 'yscrollcommand'}
+        self.options['yscrollcommand'] = None
+        reference.destroy()
+        for opt in self.list_options:
+            if opt in kw:
+                self.options[opt] = kw.pop(opt)
+        # Listbox options that have no meaning here
+        for opt in ('activestyle', 'exportselection', 'selectmode'):
+            kw.pop(opt, None)
+        tk.Frame.__init__(self, master, **kw)
+
+        self.font = tkfont.nametofont('TkDefaultFont')
+        self.row_height = self.font.metrics('linespace') + 2
+        # Border and highlight ring of the canvas
+        self.margin = 2
+        self.canvas = tk.Canvas(
+            self, highlightthickness=1, borderwidth=1, relief=tk.SUNKEN,
+            takefocus=1,
+            background=self.options['background'],
+            width=width * self.font.measure('0'),
+            height=height * self.row_height)
+        self.canvas.grid(column=0, row=0, sticky=tk.N+tk.S+tk.W+tk.E)
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+
+        self.rows = []
+        self.selection = set()
+        self.item_config = {}
+        self.top = 0
+        self.anchor = None
+        # Row the arrow keys move from, the active row of a listbox
+        self.active = 0
+        self.drag_base = set()
+        self.pool = []
+        self.redraw_job = None
+
+        self.canvas.bind('<Configure>', self.on_configure)
+        self.canvas.bind('<Button-1>', self.on_click)
+        self.canvas.bind('<Shift-Button-1>', self.on_shift_click)
+        self.canvas.bind('<Control-Button-1>', self.on_control_click)
+        self.canvas.bind('<B1-Motion>', self.on_drag)
+        self.canvas.bind('<MouseWheel>', self.on_wheel)
+        self.canvas.bind('<Button-4>', lambda e: self.yview_scroll(-3))
+        self.canvas.bind('<Button-5>', lambda e: self.yview_scroll(3))
+        self.canvas.bind('<Control-a>', self.on_select_all)
+        for key in ('Up', 'Down', 'Prior', 'Next', 'Home', 'End'):
+            self.canvas.bind('<{}>'.format(key),
+                             lambda e, key=key: self.on_key(key, False))
+            self.canvas.bind('<Shift-{}>'.format(key),
+                             lambda e, key=key: self.on_key(key, True))
+
+    # Options
+
+    def configure(self, cnf=None, **kw):
+        kw = dict(cnf or {}, **kw)
+        if 'background' in kw:
+            self.canvas.configure(background=kw['background'])
+        changed = False
+        for opt in self.list_options:
+            if opt in kw:
+                self.options[opt] = kw.pop(opt)
+                changed = True
+        if changed:
+            self.schedule_redraw()
+        if kw:
+            return tk.Frame.configure(self, **kw)
+        return None
+
+    config = configure
+
+    def cget(self, key):
+        if key in self.options:
+            return self.options[key]
+        return tk.Frame.cget(self, key)
+
+    def itemconfigure(self, index, cnf=None, **kw):
+        index = self.index(index)
+        kw = dict(cnf or {}, **kw)
+        config = self.item_config.setdefault(index, {})
+        for opt, value in kw.items():
+            if opt not in self.item_options:
+                raise tk.TclError('unknown option "-{}"'.format(opt))
+            if value == '':
+                config.pop(opt, None)
+            else:
+                config[opt] = value
+        if not config:
+            del self.item_config[index]
+        self.schedule_redraw()
+
+    itemconfig = itemconfigure
+
+    # Contents
+
+    def index(self, index, end_is_size=False):
+        if index == tk.END:
+            return len(self.rows) if end_is_size else len(self.rows) - 1
+        return int(index)
+
+    def size(self):
+        return len(self.rows)
+
+    def get(self, first, last=None):
+        if last is None:
+            return self.rows[self.index(first)]
+        return tuple(self.rows[self.index(first):self.index(last) + 1])
+
+    def _shift(self, start, offset):
+        """Move selection and item options at or after start by offset"""
+        self.selection = {i + offset if i >= start else i
+                          for i in self.selection}
+        if self.item_config:
+            self.item_config = {i + offset if i >= start else i: c
+                                for i, c in self.item_config.items()}
+
+    def _clamp_rows(self):
+        if self.anchor is not None and self.anchor >= len(self.rows):
+            self.anchor = None
+        self.active = max(0, min(self.active, len(self.rows) - 1))
+
+    def insert(self, index, *elements):
+        index = min(self.index(index, end_is_size=True), len(self.rows))
+        self.rows[index:index] = elements
+        if index < len(self.rows) - len(elements):
+            self._shift(index, len(elements))
+        self.schedule_redraw()
+
+    def delete(self, first, last=None):
+        first = self.index(first)
+        last = first if last is None else self.index(last)
+        if last < first:
+            return
+        count = last - first + 1
+        del self.rows[first:last + 1]
+        self.selection = {i for i in self.selection
+                          if i < first or i > last}
+        self.item_config = {i: c for i, c in self.item_config.items()
+                            if i < first or i > last}
+        self._shift(last + 1, -count)
+        self._clamp_rows()
+        self.set_top(self.top)
+        self.schedule_redraw()
+
+    def insert_rows(self, indices, elements):
+        """Insert elements so they end up at the ascending indices"""
+        # Where each element goes, in the indices before inserting
+        points = [i - n for n, i in enumerate(indices)]
+        rows = []
+        start = 0
+        for point, e in zip(points, elements):
+            rows.extend(self.rows[start:point])
+            rows.append(e)
+            start = point
+        rows.extend(self.rows[start:])
+        self.rows = rows
+        self.selection = {i + bisect_right(points, i)
+                          for i in self.selection}
+        self.item_config = {i + bisect_right(points, i): c
+                            for i, c in self.item_config.items()}
+        self.schedule_redraw()
+
+    def delete_rows(self, indices):
+        """Delete the rows at the ascending indices"""
+        removed = set(indices)
+        self.rows = [r for i, r in enumerate(self.rows) if i not in removed]
+        self.selection = {i - bisect_left(indices, i)
+                          for i in self.selection if i not in removed}
+        self.item_config = {i - bisect_left(indices, i): c
+                            for i, c in self.item_config.items()
+                            if i not in removed}
+        self._clamp_rows()
+        self.set_top(self.top)
+        self.schedule_redraw()
+
+    # Selection
+
+    def curselection(self):
+        return tuple(sorted(self.selection))
+
+    def selection_includes(self, index):
+        return self.index(index) in self.selection
+
+    def selection_set(self, first, last=None):
+        first = self.index(first)
+        last = first if last is None else self.index(last)
+        last = min(last, len(self.rows) - 1)
+        self.selection.update(range(first, last + 1))
+        self.schedule_redraw()
+
+    select_set = selection_set
+
+    def selection_clear(self, first, last=None):
+        first = self.index(first)
+        last = first if last is None else self.index(last)
+        if first == 0 and last >= len(self.rows) - 1:
+            self.selection.clear()
+        else:
+            self.selection.difference_update(range(first, last + 1))
+        self.schedule_redraw()
+
+    select_clear = selection_clear
+
+    def selection_changed(self):
+        self.schedule_redraw()
+        self.event_generate('<<ListboxSelect>>')
+
+    # Scrolling
+
+    def visible_rows(self):
+        return max(1, self.canvas.winfo_height() // self.row_height)
+
+    def yview(self, *args):
+        n = len(self.rows)
+        if not args:
+            if not n:
+                return 0.0, 1.0
+            last = min(1.0, (self.top + self.visible_rows()) / n)
+            return self.top / n, last
+        if args[0] == tk.MOVETO:
+            self.set_top(int(float(args[1]) * n))
+        elif args[0] == tk.SCROLL:
+            amount = int(args[1])
+            if args[2] == tk.PAGES:
+                amount *= self.visible_rows()
+            self.yview_scroll(amount)
+        return None
+
+    def yview_scroll(self, rows):
+        self.set_top(self.top + rows)
+
+    def set_top(self, top):
+        top = max(0, min(top, len(self.rows) - self.visible_rows()))
+        if top != self.top:
+            self.top = top
+            self.schedule_redraw()
+
+    def see(self, index):
+        index = self.index(index)
+        if index < self.top:
+            self.set_top(index)
+        elif index >= self.top + self.visible_rows():
+            self.set_top(index - self.visible_rows() + 1)
+
+    def nearest(self, y):
+        if not self.rows:
+            return -1
+        row = (int(y) - self.margin) // self.row_height
+        return max(0, min(self.top + row, len(self.rows) - 1))
+
+    # Events
+
+    def on_configure(self, event):
+        self.set_top(self.top)
+        self.schedule_redraw()
+
+    def on_click(self, event):
+        self.canvas.focus_set()
+        i = self.nearest(event.y)
+        if i < 0:
+            return
+        self.selection = {i}
+        self.anchor = i
+        self.active = i
+        self.drag_base = set()
+        self.selection_changed()
+
+    def on_shift_click(self, event):
+        i = self.nearest(event.y)
+        if i < 0:
+            return
+        if self.anchor is None:
+            self.anchor = i
+        lo, hi = sorted((self.anchor, i))
+        self.selection = set(range(lo, hi + 1))
+        self.active = i
+        self.drag_base = set()
+        self.selection_changed()
+
+    def on_control_click(self, event):
+        i = self.nearest(event.y)
+        if i < 0:
+            return
+        self.selection ^= {i}
+        self.anchor = i
+        self.active = i
+        self.drag_base = set(self.selection) - {i}
+        self.selection_changed()
+
+    def on_drag(self, event):
+        if self.anchor is None:
+            return
+        if event.y < 0:
+            self.yview_scroll(-1)
+        elif event.y > self.canvas.winfo_height():
+            self.yview_scroll(1)
+        i = self.nearest(min(max(event.y, 0), self.canvas.winfo_height()))
+        lo, hi = sorted((self.anchor, i))
+        selection = self.drag_base | set(range(lo, hi + 1))
+        self.active = i
+        if selection != self.selection:
+            self.selection = selection
+            self.selection_changed()
+
+    def key_target(self, key):
+        """Row a navigation key moves the active row to"""
+        page = self.visible_rows()
+        return {'Up': self.active - 1, 'Down': self.active + 1,
+                'Prior': self.active - page, 'Next': self.active + page,
+                'Home': 0, 'End': len(self.rows) - 1}[key]
+
+    def on_key(self, key, extend):
+        """Move the active row, selecting it, or with extend the rows
+        from the anchor to it, as in an extended listbox"""
+        if not self.rows:
+            return 'break'
+        i = max(0, min(self.key_target(key), len(self.rows) - 1))
+        self.active = i
+        if extend and self.anchor is not None:
+            lo, hi = sorted((self.anchor, i))
+            self.selection = set(range(lo, hi + 1))
+        else:
+            self.selection = {i}
+            self.anchor = i
+        self.drag_base = set()
+        self.see(i)
+        self.selection_changed()
+        return 'break'
+
+    def on_wheel(self, event):
+        self.yview_scroll(-3 if event.delta > 0 else 3)
+
+    def on_select_all(self, event):
+        self.selection = set(range(len(self.rows)))
+        self.selection_changed()
+
+    # Drawing
+
+    def schedule_redraw(self):
+        if self.redraw_job is None:
+            self.redraw_job = self.after_idle(self.redraw)
+
+    def redraw(self):
+        self.redraw_job = None
+        width = self.canvas.winfo_width()
+        count = self.visible_rows() + 1
+        while len(self.pool) < count:
+            rect = self.canvas.create_rectangle(0, 0, 0, 0, width=0)
+            text = self.canvas.create_text(0, 0, anchor=tk.NW,
+                                           font=self.font)
+            self.pool.append((rect, text))
+        rh = self.row_height
+        for k, (rect, text) in enumerate(self.pool):
+            i = self.top + k
+            if k >= count or i >= len(self.rows):
+                self.canvas.itemconfigure(rect, state=tk.HIDDEN)
+                self.canvas.itemconfigure(text, state=tk.HIDDEN)
+                continue
+            config = self.item_config.get(i, {})
+            if i in self.selection:
+                bg = config.get('selectbackground',
+                                self.options['selectbackground'])
+                fg = config.get('selectforeground',
+                                self.options['selectforeground'])
+            else:
+                bg = config.get('background', '')
+                fg = config.get('foreground', self.options['foreground'])
+            y = self.margin + k * rh
+            self.canvas.coords(rect, self.margin, y, width - self.margin,
+                               y + rh)
+            self.canvas.itemconfigure(rect, fill=bg, state=tk.NORMAL)
+            self.canvas.coords(text, self.margin + 2, y + 1)
+            self.canvas.itemconfigure(text, text=str(self.rows[i]), fill=fg,
+                                      state=tk.NORMAL)
+        if self.options['yscrollcommand']:
+            first, last = self.yview()
+            self.options['yscrollcommand'](first, last)
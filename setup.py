@@ -8,7 +8,7 @@ setup(
     packages=find_packages(),
     entry_points={
         'console_scripts': [
-            'nch = nch.ui:main',
+            'nch = nch.cli:main',
         ],
     },
     package_data={
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+# Times exporting refit specs serially and in worker processes, to check
+# whether the pool pays off for any spec count.
+# Usage: bench_export.py [jobs] [counts ...]
+
+import io
+import os
+import sys
+import time
+
+sys.path.append('.')
+
+import nch.classes
+import nch.export
+from synthetic import label_code
+
+
+def synthetic_specs(count):
+    classes = [cl.name_nml for cl in nch.classes.builtin]
+    return [nch.export.RefitSpec(
+        'vehicle {}'.format(i),
+        [label_code(i * 3 + k) for k in range(3)], [label_code(i)],
+        classes[i % 5:i % 5 + 3], classes[8 + i % 3:9 + i % 3])
+        for i in range(count)]
+
+
+def measure(specs, fmt, jobs):
+    start = time.perf_counter()
+    nch.export.export_specs(specs, io.StringIO(), fmt, jobs)
+    return time.perf_counter() - start
+
+
+def main():
+    jobs = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count() or 2
+    counts = [int(n) for n in sys.argv[2:]] or [200, 1000, 20000]
+    print('{} worker processes'.format(jobs))
+    for count in counts:
+        specs = synthetic_specs(count)
+        for fmt in ('nml', 'tsv'):
+            serial = measure(specs, fmt, None)
+            pooled = measure(specs, fmt, jobs)
+            print('    {:6} specs {:<4} serial {:8.1f} ms  pool {:8.1f} ms'
+                  .format(count, fmt, 1000 * serial, 1000 * pooled))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+# Times a labels and classes refresh against a local stand-in for the wiki
+# that adds a fixed delay to each response, fetching the pages one after
+# the other as before and concurrently.
+# Usage: bench_fetch.py [delay_ms] [rows]
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hashlib
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append('.')
+
+import nch.classes
+import nch.fetch
+import nch.labels
+import nch.webcache
+from synthetic import synthetic_page
+
+
+def classes_page():
+    """Action0/Cargos like page with the built-in classes"""
+    rows = ''.join(
+        '<tr><td>{}</td><td>{:04X}</td><td>{}</td><td>{}</td><td>{}</td>'
+        '<td>{}</td></tr>\n'.format(
+            cl.value.bit_length() - 1, cl.value, cl.name, cl.wagon_type,
+            cl.usage, cl.tips)
+        for cl in nch.classes.builtin)
+    return ('<html><body><h2>Properties</h2><table><tr><td>x</td></tr>'
+            '</table><h3><span class="mw-headline">CargoClasses (16)</span>'
+            '</h3><table><tr><th>Bit</th><th>Value</th><th>Meaning</th>'
+            '<th>Wagon type</th><th>Usage</th><th>Tips</th></tr>\n'
+            + rows + '</table></body></html>\n')
+
+
+def serve(pages, delay):
+    bodies = {path: text.encode('utf-8') for path, text in pages.items()}
+    etags = {path: '"{}"'.format(hashlib.sha256(body).hexdigest()[:16])
+             for path, body in bodies.items()}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            time.sleep(delay)
+            body = bodies.get(self.path)
+            if body is None:
+                self.send_error(404)
+                return
+            if self.headers.get('If-None-Match') == etags[self.path]:
+                self.send_response(304)
+                self.send_header('ETag', etags[self.path])
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('ETag', etags[self.path])
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def sequential(cache, urls):
+    labels_url, classes_url = urls
+    labels = nch.labels.labels_of_page(cache.get(labels_url), cache)
+    classes = nch.fetch.classes_of_page(cache.get(classes_url), cache)
+    return labels, classes
+
+
+def main():
+    delay = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.2
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    server = serve({'/labels': synthetic_page(rows),
+                    '/classes': classes_page()}, delay)
+    base = 'http://127.0.0.1:{}'.format(server.server_port)
+    urls = (base + '/labels', base + '/classes')
+    print('{:.0f} ms per response, {} labels'.format(1000 * delay, rows))
+    for name, func in [
+            ('sequential', sequential),
+            ('concurrent', lambda cache, urls: nch.fetch.fetch_all(
+                cache, urls=urls))]:
+        with tempfile.TemporaryDirectory() as path:
+            cache = nch.webcache.PageCache(
+                path, session=nch.fetch.pooled_session())
+            for run in ('cold', 'revalidated'):
+                start = time.perf_counter()
+                labels, classes = func(cache, urls)
+                elapsed = time.perf_counter() - start
+                print('    {:<11} {:<12} {:8.1f} ms  {} labels {} classes'
+                      .format(name, run, 1000 * elapsed, len(labels),
+                              len(classes)))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
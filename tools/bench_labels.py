@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+# Compares the streaming label parser against the old BeautifulSoup parser
+# Usage: bench_labels.py [rows | archived_page.html ...]
+
+import re
+import sys
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+
+sys.path.append('.')
+
+import nch.labels
+from synthetic import synthetic_page
+
+
+def bs4_labels(html_doc):
+    """The BeautifulSoup based parser used before the streaming parser"""
+
+    def match(row):
+        if len(row) >= 6 \
+                and re.match(r'[A-Z0-9_]', row[0]) \
+                and re.match(r'[A-F0-9]{4}', row[2]):
+            return True
+        return False
+
+    soup = BeautifulSoup(html_doc, 'html.parser')
+    table = soup.find('table')
+    labels = []
+    for tr in table.find_all('tr'):
+        row = list(td.get_text().strip() for td in tr.find_all('td'))
+        if row and re.match(r'special cargos', row[0], re.IGNORECASE):
+            break
+        if not match(row):
+            continue
+        label = row[0]
+        desc = row[1]
+        cc = int(row[2][:4], base=16)
+        if len(row) >= 8:
+            m = re.search(r'firs[-:., ]+([A-F0-9]{4})', row[7], re.IGNORECASE)
+            if m:
+                cc = int(m.group(1), base=16)
+        industries = [ind for ind in row[3:7] if ind != '']
+        labels.append(nch.labels.CargoLabel(label, desc, cc, industries))
+    return labels
+
+
+def measure(func, html_doc):
+    start = time.perf_counter()
+    labels = func(html_doc)
+    elapsed = time.perf_counter() - start
+    # Separate run, tracemalloc slows down the parsers a lot
+    tracemalloc.start()
+    func(html_doc)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return labels, elapsed, peak
+
+
+def compare(name, html_doc):
+    old, old_time, old_peak = measure(bs4_labels, html_doc)
+    new, new_time, new_peak = measure(nch.labels.parse_labels, html_doc)
+    # The old parser replaced the table classes with the FIRS ones
+    def firs(lb):
+        return (lb.label, lb.description, lb.profile_mask('FIRS'),
+                lb.industries)
+    if [firs(lb) for lb in old] != [firs(lb) for lb in new]:
+        print('{}: parsers disagree'.format(name))
+    print('{}: {} labels'.format(name, len(new)))
+    print('    bs4:       {:8.3f} s {:8.1f} MiB peak'.format(
+        old_time, old_peak / 2**20))
+    print('    streaming: {:8.3f} s {:8.1f} MiB peak'.format(
+        new_time, new_peak / 2**20))
+
+
+def main():
+    args = sys.argv[1:] or ['100', '1000', '10000']
+    for arg in args:
+        if arg.isdigit():
+            compare('{} rows'.format(arg), synthetic_page(int(arg)))
+        else:
+            with open(arg, encoding='utf-8') as f:
+                compare(arg, f.read())
+
+
+if __name__ == '__main__':
+    main()
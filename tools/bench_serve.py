@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+# Times queries against a query daemon on synthetic labels, over one kept
+# alive HTTP connection and over a Unix socket, and compares them with
+# starting a process per query as build scripts did before.
+# Usage: bench_serve.py [rows] [queries]
+
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append('.')
+
+import nch.cargos
+import nch.serve
+from synthetic import synthetic_labels
+
+QUERIES = [
+    {'op': 'labels', 'classes': ['CC_LIQUID'], 'mode': 'ANY'},
+    {'op': 'classes', 'labels': ['0001', '0002'], 'mode': 'ALL'},
+    {'op': 'effective_refit', 'cargo_allow_refit': ['0001'],
+     'refittable_cargo_classes': ['CC_BULK', 'CC_PIECE_GOODS'],
+     'non_refittable_cargo_classes': ['CC_LIQUID']},
+    {'op': 'label', 'codes': ['0003'], 'profile': 'ECS'},
+    {'op': 'check', 'included': ['CC_PASSENGERS'], 'excluded': []},
+]
+
+
+def report(name, times):
+    times = sorted(times)
+    print('    {:<12} median {:7.3f} ms  p99 {:7.3f} ms'.format(
+        name, 1000 * statistics.median(times),
+        1000 * times[int(len(times) * 0.99)]))
+
+
+def http_times(port, count):
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    times = []
+    for i in range(count):
+        body = json.dumps([QUERIES[i % len(QUERIES)]])
+        start = time.perf_counter()
+        conn.request('POST', '/query', body)
+        results = json.loads(conn.getresponse().read())
+        times.append(time.perf_counter() - start)
+        assert results[0]['ok'], results
+    conn.close()
+    return times
+
+
+def unix_times(path, count):
+    times = []
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        f = sock.makefile('rb')
+        for i in range(count):
+            body = json.dumps([QUERIES[i % len(QUERIES)]]).encode()
+            start = time.perf_counter()
+            sock.sendall(body + b'\n')
+            results = json.loads(f.readline())
+            times.append(time.perf_counter() - start)
+            assert results[0]['ok'], results
+    return times
+
+
+def process_times(rows, count):
+    # Import and index the labels in a fresh interpreter per query
+    code = ('import sys; sys.path[:0] = [".", "tools"]; import nch.cargos; '
+            'from synthetic import synthetic_labels; '
+            'c = nch.cargos.Cargos(); c.set_labels(synthetic_labels({}))')
+    times = []
+    for _ in range(count):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code.format(rows)], check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    cargos = nch.cargos.Cargos()
+    cargos.set_labels(synthetic_labels(rows))
+    service = nch.serve.Service(cargos)
+    print('{} labels, {} queries'.format(rows, count))
+
+    server = nch.serve.HTTPServer(service, 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    report('http', http_times(server.server_port, count))
+    server.shutdown()
+
+    if nch.serve.UnixServer is not None:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'nch.sock')
+            server = nch.serve.UnixServer(service, path)
+            threading.Thread(target=server.serve_forever,
+                             daemon=True).start()
+            report('unix socket', unix_times(path, count))
+            server.shutdown()
+            server.server_close()
+
+    report('process', process_times(rows, 5))
+
+
+if __name__ == '__main__':
+    main()
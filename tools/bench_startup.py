@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+# Measures import time of nch.ui, and time to first paint of the GUI
+# Usage: bench_startup.py [runs]
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ['requests', 'bs4', 'appdirs', 'pkg_resources',
+                 'multiprocessing']
+
+IMPORT_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import nch.ui
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    'import': elapsed,
+    'loaded': [m for m in %r if m in sys.modules],
+}))
+''' % HEAVY_MODULES
+
+PAINT_SCRIPT = '''
+import json, time
+start = time.perf_counter()
+import tkinter as tk
+import nch.ui
+try:
+    app = nch.ui.App()
+except tk.TclError as e:
+    print(json.dumps({'error': str(e)}))
+    raise SystemExit
+app.update()
+paint = time.perf_counter() - start
+while app.fill_job is not None or app.cargos.labels is None:
+    app.update()
+app.update()
+filled = time.perf_counter() - start
+print(json.dumps({
+    'first_paint': paint,
+    'labels_filled': filled,
+    'labels': len(app.cargos.labels),
+}))
+app.destroy()
+'''
+
+
+def run(script):
+    out = subprocess.run([sys.executable, '-c', script], cwd=ROOT,
+                         stdout=subprocess.PIPE, check=True)
+    return json.loads(out.stdout.decode().strip().splitlines()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    imports = [run(IMPORT_SCRIPT) for _ in range(runs)]
+    print('import nch.ui: {:.1f} ms median'.format(
+        1000 * statistics.median(r['import'] for r in imports)))
+    print('    heavy modules loaded: {}'.format(
+        ', '.join(imports[0]['loaded']) or 'none'))
+    paints = [run(PAINT_SCRIPT) for _ in range(runs)]
+    if 'error' in paints[0]:
+        print('first paint: skipped, {}'.format(paints[0]['error']))
+        return
+    print('first paint: {:.1f} ms median'.format(
+        1000 * statistics.median(r['first_paint'] for r in paints)))
+    print('{} labels filled: {:.1f} ms median'.format(
+        paints[0]['labels'],
+        1000 * statistics.median(r['labels_filled'] for r in paints)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+# Times the hot paths on synthetic label tables, and writes the results as
+# json so runs on different commits can be compared.
+# Also checks that memory stays flat over many label refreshes.
+# Usage: benchmark.py [--sizes 100,10000,100000] [--output results.json]
+#                     [--compare old_results.json] [--refreshes 200]
+
+import argparse
+import gc
+import io
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.append('.')
+
+import nch.cargos
+import nch.export
+import nch.labels
+import nch.rules
+import nch.search
+from synthetic import random_specs, synthetic_labels, synthetic_page
+
+SELECTIONS = 200
+VEHICLES = 1000
+# Typed into the label filter, broad and selective
+FILTER_QUERIES = ('arctic', 'cargo 12', '00A')
+
+
+def best_of(func, repeat):
+    """Fastest of repeat runs, in seconds"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def cargos_for(labels):
+    cargos = nch.cargos.Cargos()
+    cargos.set_labels(labels)
+    return cargos
+
+
+def bench_size(size, repeat):
+    rng = random.Random(size)
+    page = synthetic_page(size)
+    labels = synthetic_labels(size)
+    cargos = cargos_for(labels)
+    specs = random_specs(labels, VEHICLES)
+    class_masks = [rng.getrandbits(13) for _ in range(SELECTIONS)]
+    label_selections = [
+        cargos.label_bits(rng.sample(labels, min(50, size)))
+        for _ in range(SELECTIONS)]
+
+    def select_labels():
+        cargos.query_cache.clear()
+        for mask in class_masks:
+            for mode in ('ANY', 'ALL', 'NONE'):
+                cargos.match_labels(mask, mode)
+
+    def select_classes():
+        cargos.query_cache.clear()
+        for bits in label_selections:
+            for mode in ('ANY', 'ALL', 'NONE'):
+                cargos.match_classes(bits, mode)
+
+    def effective_refits():
+        cargos.query_cache.clear()
+        cargos.effective_refits(specs)
+
+    def export(fmt):
+        refit_specs = [
+            nch.export.RefitSpec(
+                'vehicle', allow, disallow,
+                [cl.name_nml for cl in cargos.classes_of(incl)],
+                [cl.name_nml for cl in cargos.classes_of(excl)])
+            for allow, disallow, incl, excl in specs]
+
+        def run():
+            nch.export.export_specs(refit_specs, io.StringIO(), fmt, jobs=1)
+        return run
+
+    search_index = nch.search.LabelIndex(labels)
+
+    def filter_typing():
+        # Every prefix of the query, like typing into the filter entry,
+        # with the index built beforehand as on refresh
+        index = search_index
+        index.cache.clear()
+        for query in FILTER_QUERIES:
+            for n in range(1, len(query) + 1):
+                index.search(query[:n])
+
+    def cargotable():
+        nch.export.cargotable(lb.label for lb in labels)
+
+    cases = [
+        ('parse', lambda: nch.labels.parse_labels(page)),
+        ('refresh_mapping', lambda: cargos_for(labels)),
+        ('select_labels', select_labels),
+        ('select_classes', select_classes),
+        ('warnings', lambda: nch.rules.check_many(
+            (incl, excl) for _, _, incl, excl in specs)),
+        ('effective_refit', effective_refits),
+        ('export_nml', export('nml')),
+        ('export_tsv', export('tsv')),
+        ('export_cargotable', cargotable),
+        ('search_index', lambda: nch.search.LabelIndex(labels)),
+        ('filter', filter_typing),
+    ]
+    results = []
+    for name, func in cases:
+        seconds = best_of(func, repeat)
+        results.append({'name': name, 'size': size, 'seconds': seconds})
+        print('{:>8} {:<20} {:10.3f} ms'.format(size, name, 1000 * seconds))
+    return results
+
+
+def refresh_memory(size, refreshes):
+    """Traced memory growth over many refreshes of a long lived Cargos,
+    in bytes. Each refresh gets new label objects, as from the wiki."""
+    rows = nch.labels.labels_to_rows(synthetic_labels(size))
+    cargos = cargos_for(nch.labels.labels_from_rows(rows))
+
+    def refresh(n):
+        labels = nch.labels.labels_from_rows(rows)
+        # A few changed labels, so the diff keeps some new objects
+        for lb in labels[n % 7::max(1, size // 10)]:
+            lb.description += ' '
+        diff = nch.labels.diff_labels(cargos.labels, labels)
+        cargos.set_labels(diff.labels)
+        # Other instances must not keep or share the class relations
+        cargos_for(labels).match_labels(1, 'ANY')
+
+    tracemalloc.start()
+    try:
+        for n in range(5):
+            refresh(n)
+        gc.collect()
+        before = tracemalloc.get_traced_memory()[0]
+        for n in range(refreshes):
+            refresh(n)
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return after - before
+
+
+def git_revision():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+    return out.stdout.decode().strip() or None
+
+
+def compare(old, new):
+    """Print the change from old to new results"""
+    old_times = {(r['name'], r['size']): r['seconds']
+                 for r in old['results']}
+    print('\nChange from {}:'.format(old.get('revision')))
+    for r in new['results']:
+        before = old_times.get((r['name'], r['size']))
+        if before:
+            print('{:>8} {:<20} {:+8.1f} %'.format(
+                r['size'], r['name'],
+                100 * (r['seconds'] - before) / before))
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--sizes', default='100,10000,100000')
+    p.add_argument('--repeat', type=int, default=3)
+    p.add_argument('--output', help='write results to this json file')
+    p.add_argument('--compare', help='json results to compare against')
+    p.add_argument(
+        '--refreshes', type=int, default=200,
+        help='refreshes in the memory check, run at the smallest size')
+    p.add_argument(
+        '--max-growth', type=int, default=1 << 16,
+        help='bytes of memory growth over the refreshes that fail the check')
+    args = p.parse_args()
+
+    results = []
+    sizes = [int(size) for size in args.sizes.split(',')]
+    for size in sizes:
+        results.extend(bench_size(size, args.repeat))
+    growth = None
+    if args.refreshes:
+        growth = refresh_memory(min(sizes), args.refreshes)
+        print('{:>8} {:<20} {:10d} bytes over {} refreshes'.format(
+            min(sizes), 'memory_growth', growth, args.refreshes))
+    data = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+        'memory_growth': growth,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(data, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), data)
+    if growth is not None and growth > args.max_growth:
+        sys.exit('memory grew by {} bytes over {} refreshes'.format(
+            growth, args.refreshes))
+
+
+if __name__ == '__main__':
+    main()
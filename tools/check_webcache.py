@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+# Checks the page cache against a local stand-in for the wiki: a 304 reuses
+# the cached body, a changed ETag replaces it, a failed request falls back
+# to the cached copy. Exits with an assertion error on the first failure.
+# Usage: check_webcache.py
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import sys
+import tempfile
+import threading
+
+sys.path.append('.')
+
+import nch.webcache
+
+
+class Page:
+    """Body and ETag the stand-in serves, and the statuses it sent"""
+
+    def __init__(self, text, etag):
+        self.text = text
+        self.etag = etag
+        self.error = None
+        self.statuses = []
+
+
+def serve(page):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            if page.error:
+                self.send_error(page.error)
+                page.statuses.append(page.error)
+                return
+            if self.headers.get('If-None-Match') == page.etag:
+                self.send_response(304)
+                self.send_header('ETag', page.etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                page.statuses.append(304)
+                return
+            body = page.text.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('ETag', page.etag)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            page.statuses.append(200)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bodies(path):
+    return [name for name in os.listdir(path) if name.endswith('.body')]
+
+
+def main():
+    page = Page('<p>first ä</p>', '"1"')
+    server = serve(page)
+    url = 'http://127.0.0.1:{}/page'.format(server.server_port)
+    with tempfile.TemporaryDirectory() as path:
+        cache = nch.webcache.PageCache(path, timeout=5)
+
+        first = cache.get(url)
+        assert page.statuses == [200], page.statuses
+        assert first.text == page.text
+        assert first.changed and not first.from_cache
+
+        # Unchanged page, revalidated with the ETag
+        again = cache.get(url)
+        assert page.statuses[-1] == 304, page.statuses
+        assert again.text == first.text
+        assert again.digest == first.digest
+        assert not again.changed and not again.from_cache
+
+        # Changed page, the new body replaces the old one
+        page.text = '<p>second</p>'
+        page.etag = '"2"'
+        second = cache.get(url)
+        assert page.statuses[-1] == 200, page.statuses
+        assert second.text == page.text
+        assert second.digest != first.digest
+        assert second.changed and not second.from_cache
+        assert bodies(path) == [second.digest + '.body'], bodies(path)
+        assert not cache.get(url).changed
+
+        # Server errors and connection errors give the cached copy
+        page.error = 500
+        stale = cache.get(url)
+        assert page.statuses[-1] == 500, page.statuses
+        assert stale.text == second.text
+        assert stale.from_cache and not stale.changed
+        server.shutdown()
+        server.server_close()
+        stale = cache.get(url)
+        assert stale.text == second.text
+        assert stale.from_cache and not stale.changed
+
+        # Without a cached copy the error is raised
+        import requests
+        try:
+            nch.webcache.PageCache(os.path.join(path, 'empty'),
+                                   timeout=5).get(url)
+        except requests.RequestException:
+            pass
+        else:
+            raise AssertionError('uncached failed request did not raise')
+    print('ok')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,32 @@
 #!/usr/bin/env python3
 
-# Parses cargo classes from newgrf wiki
-# Outputs python dict elements, nml names have to added manually
+# Parses cargo classes from newgrf wiki, as the app does on refresh, and
+# prints how they differ from the built-in definitions in nch/classes.py
 
-from bs4 import BeautifulSoup
-import requests
+import sys
+
+sys.path.append('.')
+
+import nch.classes
+import nch.fetch
+import nch.webcache
+
+FIELDS = ('name', 'wagon_type', 'usage', 'tips')
 
 
 def main():
-    r = requests.get('https://newgrf-specs.tt-wiki.net/wiki/Action0/Cargos')
-    s = BeautifulSoup(r.text, 'html.parser')
-    h = s.find(class_='mw-headline', string='CargoClasses (16)')
-    table = h.parent.find_next_sibling('table')
-    rows = []
-    for tr in table.find_all('tr'):
-        rows.append([td.get_text().strip() for td in tr.find_all('td')])
-    rows = rows[1:-3]
-    for r in rows:
-        print('value=0x{}'.format(r[1]))
-        print("class_name='{}'".format(r[2]))
-        print("wagon_type='{}'".format(r[3]))
-        print("usage='{}'".format(r[4]))
-        print("tips='{}'".format(r[5]))
-        print()
+    cache = nch.webcache.PageCache(session=nch.fetch.pooled_session(1))
+    page = cache.get(nch.classes.CLASSES_URL)
+    classes = nch.classes.parse_classes(page.text)
+    builtin = {cl.value: cl for cl in nch.classes.builtin}
+    for cl in classes:
+        old = builtin.pop(cl.value, None)
+        for field in FIELDS:
+            if old is None or getattr(old, field) != getattr(cl, field):
+                print('{} {}: {!r}'.format(cl.name_nml, field,
+                                           getattr(cl, field)))
+    for cl in builtin.values():
+        print('{}: missing from the wiki'.format(cl.name_nml))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,64 @@
+# Synthetic CargoTypes pages and label tables for the benchmarks
+
+import random
+
+import nch.classes
+import nch.labels
+
+
+def synthetic_page(rows, special_rows=100):
+    """CargoTypes like page with the given number of label rows"""
+    out = ['<html><body><h1>CargoTypes</h1><table>\n',
+           '<tr><th>Label</th><th>Description</th><th>Classes</th>'
+           '<th>TTD</th><th>ECS</th><th>FIRS</th><th>YETI</th>'
+           '<th>Notes</th></tr>\n']
+    for i in range(rows + special_rows):
+        if i == rows:
+            out.append('<tr><td colspan="8">Special cargos</td></tr>\n')
+        note = 'FIRS: {:04X}'.format((i * 7) & 0x1FFF) if i % 5 == 0 else ''
+        out.append(
+            '<tr><td>{}</td><td>Cargo &amp; {}</td><td>{:04X}</td>'
+            '<td>Temperate</td><td>{}</td><td></td><td>FIRS</td>'
+            '<td>{}</td></tr>\n'.format(
+                label_code(i), i, (i * 13) & 0x1FFF,
+                'Arctic' if i % 2 else '', note))
+    out.append('</table><p>{}</p></body></html>\n'.format('x' * 100000))
+    return ''.join(out)
+
+
+def label_code(i):
+    """Unique 4 character label code for up to 36**4 labels"""
+    chars = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    code = ''
+    for _ in range(4):
+        i, rem = divmod(i, len(chars))
+        code = chars[rem] + code
+    return code
+
+
+def synthetic_labels(rows):
+    return [nch.labels.CargoLabel(
+                label_code(i), 'Cargo {}'.format(i), (i * 13) & 0x1FFF,
+                ['Temperate', 'Arctic'] if i % 2 else ['Temperate'])
+            for i in range(rows)]
+
+
+def random_class_mask(rng, p=0.3):
+    mask = 0
+    for cl in nch.classes.builtin:
+        if rng.random() < p:
+            mask |= cl.value
+    return mask
+
+
+def random_specs(labels, count, seed=0):
+    """(allow, disallow, included mask, excluded mask) per vehicle"""
+    rng = random.Random(seed)
+    codes = [lb.label for lb in labels]
+    specs = []
+    for _ in range(count):
+        incl = random_class_mask(rng)
+        excl = random_class_mask(rng, 0.15) & ~incl
+        specs.append((rng.sample(codes, min(3, len(codes))),
+                      rng.sample(codes, min(2, len(codes))), incl, excl))
+    return specs